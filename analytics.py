@@ -0,0 +1,177 @@
+import threading
+from array import array
+from datetime import date
+
+from scheduling import parse_minute, today_str
+
+HOURS = 24
+# 預約前置時間（預約當下距離預約開始）分布的區間上限（小時），最後一個區間為超過最後的上限
+LEAD_TIME_EDGES = (2, 6, 12, 24, 48, 72, 168, 336)
+# 保留的天數（以預約日期計）
+RETENTION_DAYS = 180
+# 保留範圍中留給未來日期的天數，其餘為今天及過去的日期
+FUTURE_DAYS = 60
+
+
+def _zeros(length):
+    return array('I', [0]) * length
+
+
+class BookingStats:
+    """預約的統計計數器，預約、取消及未到時各更新一次，不需重新掃描行事曆
+
+    以預約日期分桶，每天一個桶，存放在固定長度的 array 中循環使用：
+    桶的位置為 日期序數 % retention_days，_bucket_days 記錄每個桶目前屬於哪一天，
+    寫入較新的日期時先清空該桶，比桶中的日期舊的事件則已超出保留範圍而略過。
+    只記錄今天前後 retention_days 天內（未來最多 future_days 天）的日期，
+    避免一筆很遠的未來預約佔用桶而清除最近的統計。
+    查詢一段日期只需加總範圍內的桶（O(天數 × 24)），與預約筆數無關。
+
+    - 每位美甲師每小時被預約的分鐘數（取消時扣除），用來計算使用率
+    - 每項服務每小時開始的預約數（需求，取消後仍計入）
+    - 每天的預約、取消及未到數
+    - 預約前置時間的分布
+    """
+
+    def __init__(self, retention_days=RETENTION_DAYS, future_days=FUTURE_DAYS):
+        self.retention_days = retention_days
+        self.future_days = min(future_days, retention_days - 1)
+        self._lock = threading.Lock()
+        self._bucket_days = array('l', [-1]) * retention_days
+        self._bookings = _zeros(retention_days)
+        self._cancellations = _zeros(retention_days)
+        self._no_shows = _zeros(retention_days)
+        self._lead_times = _zeros(retention_days * (len(LEAD_TIME_EDGES) + 1))
+        self._stylist_minutes = {}  # {美甲師ID: array[桶 * 24 + 小時] = 分鐘}
+        self._service_demand = {}  # {服務: array[桶 * 24 + 小時] = 預約數}
+
+    def reset_worker_state(self):
+        """fork 後在子程序中重新建立鎖"""
+        self._lock = threading.Lock()
+
+    def _bucket(self, date_str):
+        """回傳日期的桶位置，超出保留範圍時回傳None"""
+        day = date.fromisoformat(date_str).toordinal()
+        latest = date.fromisoformat(today_str()).toordinal() + self.future_days
+        if not latest - self.retention_days < day <= latest:
+            return None
+        index = day % self.retention_days
+        current = self._bucket_days[index]
+        if current == day:
+            return index
+        if current > day:
+            return None
+        self._bookings[index] = self._cancellations[index] = self._no_shows[index] = 0
+        bins = len(LEAD_TIME_EDGES) + 1
+        self._lead_times[index * bins:(index + 1) * bins] = _zeros(bins)
+        for counts in (*self._stylist_minutes.values(), *self._service_demand.values()):
+            counts[index * HOURS:(index + 1) * HOURS] = _zeros(HOURS)
+        self._bucket_days[index] = day
+        return index
+
+    def _hourly(self, table, key):
+        counts = table.get(key)
+        if counts is None:
+            counts = table[key] = _zeros(self.retention_days * HOURS)
+        return counts
+
+    @staticmethod
+    def _spread(counts, index, start, duration, sign):
+        """把 [start, start + duration) 的分鐘數依小時加到（sign=-1 時扣除）counts 的桶中"""
+        end = min(start + duration, HOURS * 60)
+        while start < end:
+            hour = start // 60
+            minutes = min(end, (hour + 1) * 60) - start
+            position = index * HOURS + hour
+            counts[position] = max(0, counts[position] + sign * minutes)
+            start += minutes
+
+    def record_booking(self, date_str, time_str, stylist_id, service, duration, lead_hours=None):
+        """記錄一筆預約；lead_hours 為預約當下距離預約開始的小時數，未知（例如匯入的預約）時不計入分布"""
+        start = parse_minute(time_str)
+        with self._lock:
+            index = self._bucket(date_str)
+            if index is None:
+                return
+            self._bookings[index] += 1
+            self._spread(self._hourly(self._stylist_minutes, stylist_id), index, start, duration, 1)
+            self._hourly(self._service_demand, service)[index * HOURS + start // 60] += 1
+            if lead_hours is not None:
+                bin_index = sum(1 for edge in LEAD_TIME_EDGES if lead_hours >= edge)
+                self._lead_times[index * (len(LEAD_TIME_EDGES) + 1) + bin_index] += 1
+
+    def record_cancellation(self, date_str, time_str, stylist_id, duration):
+        """記錄一筆取消，並從美甲師的使用時間中扣除"""
+        start = parse_minute(time_str)
+        with self._lock:
+            index = self._bucket(date_str)
+            if index is None:
+                return
+            self._cancellations[index] += 1
+            if stylist_id in self._stylist_minutes:
+                self._spread(self._stylist_minutes[stylist_id], index, start, duration, -1)
+
+    def record_no_show(self, date_str):
+        """記錄一筆未到（美甲師的時段已被佔用，使用時間不扣除）"""
+        with self._lock:
+            index = self._bucket(date_str)
+            if index is not None:
+                self._no_shows[index] += 1
+
+    def report(self, start_date, end_date, open_minute, close_minute):
+        """彙總 start_date ~ end_date（含首尾，最多 retention_days 天）的統計
+
+        使用率 = 被預約的分鐘數 / (營業時間 × 天數)。
+        """
+        last = date.fromisoformat(end_date).toordinal()
+        first = max(date.fromisoformat(start_date).toordinal(), last - self.retention_days + 1)
+        day_count = max(0, last - first + 1)
+        bins = len(LEAD_TIME_EDGES) + 1
+        with self._lock:
+            indexes = [
+                day % self.retention_days for day in range(first, last + 1)
+                if self._bucket_days[day % self.retention_days] == day
+            ]
+            bookings = sum(self._bookings[i] for i in indexes)
+            cancellations = sum(self._cancellations[i] for i in indexes)
+            no_shows = sum(self._no_shows[i] for i in indexes)
+            lead_times = [sum(self._lead_times[i * bins + b] for i in indexes) for b in range(bins)]
+            stylist_hours = {key: self._sum_hours(counts, indexes) for key, counts in self._stylist_minutes.items()}
+            service_hours = {key: self._sum_hours(counts, indexes) for key, counts in self._service_demand.items()}
+
+        available_minutes = max(0, close_minute - open_minute) * day_count
+        busy_hours = [sum(hours[hour] for hours in service_hours.values()) for hour in range(HOURS)]
+        return {
+            'start': date.fromordinal(first).isoformat() if day_count else start_date,
+            'end': end_date,
+            'days': day_count,
+            'bookings': bookings,
+            'cancellations': cancellations,
+            'no_shows': no_shows,
+            'cancellation_rate': cancellations / bookings if bookings else 0.0,
+            'no_show_rate': no_shows / bookings if bookings else 0.0,
+            'stylists': {
+                stylist_id: {
+                    'booked_minutes': sum(hours),
+                    'available_minutes': available_minutes,
+                    'occupancy': sum(hours) / available_minutes if available_minutes else 0.0,
+                    'minutes_by_hour': hours,
+                }
+                for stylist_id, hours in stylist_hours.items()
+            },
+            'service_demand_by_hour': service_hours,
+            'busy_hours': busy_hours,
+            'lead_time_hours': {
+                'edges': list(LEAD_TIME_EDGES),
+                'counts': lead_times,
+            },
+        }
+
+    @staticmethod
+    def _sum_hours(counts, indexes):
+        hours = [0] * HOURS
+        for index in indexes:
+            offset = index * HOURS
+            for hour in range(HOURS):
+                hours[hour] += counts[offset + hour]
+        return hours
@@ -2,230 +2,473 @@ import os
 import sys
 import logging
 from datetime import datetime, timedelta
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, Blueprint, Response, request, abort, stream_with_context
+from linebot import LineBotApi
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage,
-    TemplateSendMessage, ButtonsTemplate, PostbackEvent,
+    TextSendMessage, TemplateSendMessage, ButtonsTemplate,
     PostbackTemplateAction, DatetimePickerTemplateAction,
     CarouselTemplate, CarouselColumn, ImageSendMessage,
-    LocationSendMessage, FollowEvent
+    LocationSendMessage, MessageTemplateAction
 )
+import io
+import csv
 import json
+import time
+import heapq
+import hmac
+import base64
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, TimeoutError as FuturesTimeout
 import requests
 import werkzeug.exceptions  # 引入 werkzeug.exceptions
+from collections import defaultdict
+from catalog import CatalogStore
+from webhook import parse_events
+from profiles import ProfileCache
+from deadline import Deadline, deadline_scope, budget, current_deadline
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
+from scheduling import TAIPEI_TZ, DaySchedule, Service, format_minute, parse_minute
+from waitlist import ANY_MANICURIST
+from tenants import DEFAULT_TENANT, Tenant, TenantRegistry, tenant_env, tenant_scope, current_tenant
+from log_setup import configure_logging
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
+# 大量的日誌使用獨立的 logger，可透過 LOG_LEVELS / LOG_SAMPLE 個別調整等級及取樣
+health_logger = logging.getLogger('app.health')
+webhook_logger = logging.getLogger('app.webhook')
 
 # 嘗試導入Google行事曆所需的庫，如果不存在則捕獲異常
-GOOGLE_CALENDAR_AVAILABLE = False
-calendar_service = None
 try:
     from google.oauth2 import service_account
     from googleapiclient.discovery import build
     import dateutil.parser
-    import io
+    GOOGLE_LIBRARIES_AVAILABLE = True
+except ImportError:
+    GOOGLE_LIBRARIES_AVAILABLE = False
+
+# 共用的服務帳戶憑證，由 create_app 載入
+GOOGLE_CALENDAR_AVAILABLE = False
+google_credentials = None
+
+def load_google_credentials():
+    """載入共用的 Google 服務帳戶憑證，未設定或失敗時回傳None
     
-    # 初始化Google Calendar服務
+    優先使用 GOOGLE_APPLICATION_CREDENTIALS_JSON，其次是 GOOGLE_APPLICATION_CREDENTIALS 指向的檔案。
+    只建立憑證，不建立行事曆服務（連線由各執行緒在第一次使用時建立，見 get_thread_calendar_service）。
+    """
+    if not GOOGLE_LIBRARIES_AVAILABLE:
+        logger.error("Google Calendar API 依賴未安裝，無法初始化API")
+        return None
     try:
         # 嘗試從JSON環境變量獲取憑證
         google_creds_json = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON")
         if google_creds_json:
             logger.info("找到 GOOGLE_APPLICATION_CREDENTIALS_JSON 環境變量")
             try:
-                service_account_info = json.loads(google_creds_json)
                 credentials = service_account.Credentials.from_service_account_info(
-                    service_account_info,
+                    json.loads(google_creds_json),
                     scopes=['https://www.googleapis.com/auth/calendar']
                 )
-                calendar_service = build('calendar', 'v3', credentials=credentials)
-                GOOGLE_CALENDAR_AVAILABLE = True
                 logger.info("Google Calendar API 從環境變量JSON初始化成功")
+                return credentials
             except json.JSONDecodeError as e:
                 logger.error(f"GOOGLE_APPLICATION_CREDENTIALS_JSON 格式錯誤: {str(e)}")
-                GOOGLE_CALENDAR_AVAILABLE = False
-        else:
-            # 嘗試從文件路徑獲取憑證作為備選
-            creds_file_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-            if creds_file_path:
-                logger.info(f"找到 GOOGLE_APPLICATION_CREDENTIALS 環境變量: {creds_file_path}")
-                credentials = service_account.Credentials.from_service_account_file(
-                    creds_file_path,
-                    scopes=['https://www.googleapis.com/auth/calendar']
-                )
-                calendar_service = build('calendar', 'v3', credentials=credentials)
-                GOOGLE_CALENDAR_AVAILABLE = True
-                logger.info("Google Calendar API 從憑證文件初始化成功")
-            else:
-                logger.warning("未找到Google Calendar憑證，無法初始化API")
-                GOOGLE_CALENDAR_AVAILABLE = False
+                return None
+        # 嘗試從文件路徑獲取憑證作為備選
+        creds_file_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+        if creds_file_path:
+            logger.info(f"找到 GOOGLE_APPLICATION_CREDENTIALS 環境變量: {creds_file_path}")
+            credentials = service_account.Credentials.from_service_account_file(
+                creds_file_path,
+                scopes=['https://www.googleapis.com/auth/calendar']
+            )
+            logger.info("Google Calendar API 從憑證文件初始化成功")
+            return credentials
+        logger.warning("未找到Google Calendar憑證，無法初始化API")
     except Exception as e:
         logger.error(f"Google Calendar API 初始化失敗: {str(e)}")
-        GOOGLE_CALENDAR_AVAILABLE = False
-except ImportError:
-    logger.error("Google Calendar API 依賴未安裝，無法初始化API")
-    GOOGLE_CALENDAR_AVAILABLE = False
+    return None
 
-app = Flask(__name__)
+# LINE webhook 及健康檢查
+bot_bp = Blueprint('bot', __name__)
 
 # 處理 404 錯誤
-@app.errorhandler(404)
 def handle_404(e):
     logger.warning(f"404 錯誤: {str(e)}，請求路徑: {request.path}")
     return "Not Found", 404
     
 # 全局異常處理（只處理其他異常）
-@app.errorhandler(Exception)
 def handle_exception(e):
     # 避免重複處理 404 錯誤
     if isinstance(e, werkzeug.exceptions.NotFound):
         return handle_404(e)
+    # 其他HTTP錯誤（例如簽名無效的400）保留原本的狀態碼
+    if isinstance(e, werkzeug.exceptions.HTTPException):
+        return e
     logger.error(f"全局異常: {str(e)}，請求路徑: {request.path}")
     return "伺服器錯誤，請稍後再試", 500
 
 # 修復健康檢查路由，支援 HEAD 和 GET 請求
-@app.route("/", methods=['GET', 'HEAD'])
+@bot_bp.route("/", methods=['GET', 'HEAD'])
 def health_check():
     """提供簡單的健康檢查端點，確認服務器是否正常運行"""
-    logger.info("收到健康檢查請求")
+    health_logger.info("收到健康檢查請求")
     status = {
         "status": "ok",
-        "line_bot": "initialized" if line_bot_api else "error"
+        "tenants": {
+            "configured": len(tenant_registry.configs),
+            "active": tenant_registry.active_count()
+        },
+        "calendar": {
+            tenant.tenant_id: {
+                "state": tenant.calendar_breaker.state,
+                "pending_writes": len(tenant.pending_calendar_writes)
+            }
+            for tenant in tenant_registry.active_tenants()
+        }
     }
     return json.dumps(status), 200
 
-# 從環境變數取得設定
-channel_secret = os.environ.get('LINE_CHANNEL_SECRET', '您的 Channel Secret')
-channel_access_token = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '您的 Channel Access Token')
+# 服務目錄、美甲師資料及訊息模板的默認設定檔
+CATALOG_PATH = os.environ.get('CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.json'))
 
-logger.info(f"Channel secret: {'已設定' if channel_secret else '未設定'}")
-logger.info(f"Channel token: {'已設定' if channel_access_token else '未設定'}")
+def load_tenant_configs():
+    """讀取各店家的設定 {店家ID: 設定}
+    
+    TENANTS_CONFIG 指向JSON設定檔，每間店可設定 destination（機器人的用戶ID）、channel_secret、
+    channel_access_token、catalog_path、calendar_id、manicurist_calendar_ids 及 google_credentials_file；
+    Channel Secret 及 Access Token 也可用 LINE_CHANNEL_SECRET_<店家ID> 等環境變量提供。
+    未設定 TENANTS_CONFIG 時，以原本的環境變量組成單一店家。
+    """
+    config_path = os.environ.get('TENANTS_CONFIG')
+    if not config_path:
+        return {DEFAULT_TENANT: {
+            'channel_secret': os.environ.get('LINE_CHANNEL_SECRET', '您的 Channel Secret'),
+            'channel_access_token': os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '您的 Channel Access Token'),
+            'catalog_path': CATALOG_PATH,
+            'calendar_id': os.environ.get('GOOGLE_CALENDAR_ID'),
+            'manicurist_calendar_ids': {
+                name[len('GOOGLE_CALENDAR_ID_'):]: value
+                for name, value in os.environ.items() if name.startswith('GOOGLE_CALENDAR_ID_')
+            }
+        }}
+    
+    with open(config_path, encoding='utf-8') as f:
+        configs = json.load(f)
+    # 設定檔中的相對路徑以設定檔所在的目錄為準
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    for settings in configs.values():
+        for key in ('catalog_path', 'google_credentials_file'):
+            if settings.get(key):
+                settings[key] = os.path.join(base_dir, settings[key])
+    return configs
 
-# 初始化LINE Bot API
-try:
+# 各店家的用戶顯示名稱快取共用同一個執行緒池（每個工作程序各自建立，見 init_worker_state）
+profile_executor = None
+
+# Postback 資料簽章，避免使用者偽造或重放過期的選項
+POSTBACK_SIGNATURE_LENGTH = 11
+
+def make_postback_signer(channel_secret):
+    """建立以店家的 Channel Secret 簽章的函數"""
+    key = channel_secret.encode('utf-8')
+    
+    def sign(*fields):
+        """將欄位以 '|' 串接並附上簡短的HMAC簽章，例如 's|基礎凝膠|<簽章>'"""
+        payload = "|".join(str(field) for field in fields)
+        digest = hmac.new(key, payload.encode('utf-8'), hashlib.sha256).digest()
+        signature = base64.urlsafe_b64encode(digest).decode('ascii')[:POSTBACK_SIGNATURE_LENGTH]
+        return f"{payload}|{signature}"
+    return sign
+
+def load_tenant_credentials(tenant_id, settings):
+    """店家自己的 Google 服務帳戶憑證，未設定時回傳None（使用共用的憑證）"""
+    credentials_file = settings.get('google_credentials_file') or tenant_env(tenant_id, 'GOOGLE_APPLICATION_CREDENTIALS')
+    if not credentials_file or not GOOGLE_LIBRARIES_AVAILABLE:
+        return None
+    try:
+        return service_account.Credentials.from_service_account_file(
+            credentials_file,
+            scopes=['https://www.googleapis.com/auth/calendar']
+        )
+    except Exception as e:
+        logger.error(f"載入店家 {tenant_id} 的Google憑證失敗，改用共用的憑證: {str(e)}")
+        return None
+
+def build_tenant(tenant_id, settings, records):
+    """建立店家的 LINE 客戶端、服務目錄及快取（第一次收到該店的請求時呼叫）"""
+    channel_secret = tenant_env(tenant_id, 'LINE_CHANNEL_SECRET', settings.get('channel_secret'))
+    channel_access_token = tenant_env(tenant_id, 'LINE_CHANNEL_ACCESS_TOKEN', settings.get('channel_access_token'))
+    if not channel_secret or not channel_access_token:
+        raise Exception(f"店家 {tenant_id} 未設定 Channel Secret 或 Access Token")
+    
     line_bot_api = LineBotApi(channel_access_token)
-    handler = WebhookHandler(channel_secret)
-    logger.info("LINE Bot API 已成功初始化")
-except Exception as e:
-    logger.error(f"初始化LINE Bot API時發生錯誤: {e}")
-    line_bot_api = None
-    handler = WebhookHandler("dummy_secret")
-
-# 美甲師資料 (實際應用建議使用資料庫)
-manicurists = {
-    '1': {
-        'name': '王綺綺',
-        'title': '闆娘',
-        'bio': '台灣🇹🇼TNA指甲彩繪技能職類丙級🪪日本🇯🇵pregel 1級🪪日本🇯🇵pregel 2級🪪美甲美學｜足部香氛SPA｜',
-        'image_url': 'https://example.com/images/wang_qiqi.jpg',
-        'calendar': {}
-    },
-    '2': {
-        'name': '李明美',
-        'title': '資深美甲師',
-        'bio': '擅長各種風格設計，提供客製化服務。專精日系美甲、法式美甲、寶石裝飾。',
-        'image_url': 'https://example.com/images/li_mingmei.jpg',
-        'calendar': {}
-    },
-    '3': {
-        'name': '陳曉婷',
-        'title': '美甲師',
-        'bio': '擁有多年美甲經驗，提供專業手足護理和美甲服務。擅長手繪藝術及繁複設計。',
-        'image_url': 'https://example.com/images/chen_xiaoting.jpg',
-        'calendar': {}
-    }
-}
-
-# 服務項目
-services = {
-    "美甲服務": ["基本美甲", "凝膠美甲", "卸甲服務", "手足護理", "光療美甲", "指甲彩繪"]
-}
-
-# 營業時間
-business_hours = {
-    "start": 10,
-    "end": 20,
-    "interval": 60
-}
-
-# 儲存預約資訊 (實際應用建議使用資料庫)
-bookings = {}
-
-@app.route("/callback", methods=['POST'], strict_slashes=False)
-def callback():
-    logger.info(f"收到 /callback 請求，方法: {request.method}, 路徑: {request.path}, 頭部: {request.headers}")
+    sign_postback = make_postback_signer(channel_secret)
+    # 服務目錄檔案變更時自動重新載入
+    catalog_store = CatalogStore(
+        settings.get('catalog_path') or CATALOG_PATH,
+        postback_signer=sign_postback,
+        check_interval=float(os.environ.get('CATALOG_CHECK_INTERVAL', 2))
+    )
+    # 用戶顯示名稱快取，預約及提醒時不需每次查詢 LINE API
+    profile_cache = ProfileCache(
+        fetch_profile=lambda user_id: line_bot_api.get_profile(user_id, timeout=3),
+        executor=profile_executor,
+        max_size=int(os.environ.get('PROFILE_CACHE_SIZE', 2048)),
+        ttl=int(os.environ.get('PROFILE_CACHE_TTL', 3600)),
+        negative_ttl=int(os.environ.get('PROFILE_NEGATIVE_TTL', 600))
+    )
+    tenant = Tenant(
+        tenant_id, settings,
+        channel_secret=channel_secret,
+        line_bot_api=line_bot_api,
+        sign_postback=sign_postback,
+        catalog_store=catalog_store,
+        profile_cache=profile_cache,
+        records=records,
+        google_credentials=load_tenant_credentials(tenant_id, settings),
+        calendar_breaker_factory=build_calendar_breaker
+    )
+    # 店家被釋放前延後的行事曆寫入保存在預約紀錄中，重新建立時（新的斷路器為關閉狀態）補寫
+    if records.pending_calendar_writes:
+        task_executor.submit(flush_pending_calendar_writes, tenant)
+    return tenant
+
+# 店家狀態在第一次使用時建立，活躍店家超過上限或閒置過久時釋放（由 create_app 建立）
+tenant_registry = None
+
+# 回覆期限：LINE 的 reply token 在事件發生後一段時間就會失效
+REPLY_DEADLINE_SECONDS = float(os.environ.get('REPLY_DEADLINE_SECONDS', 25))
+# 保留給送出回覆本身的時間
+REPLY_RESERVE_SECONDS = float(os.environ.get('REPLY_RESERVE_SECONDS', 2))
+# 先回覆處理中訊息後，背景工作最多再延長的時間，完成後以推播送出結果
+ASYNC_GRACE_SECONDS = float(os.environ.get('ASYNC_GRACE_SECONDS', 30))
+# 單次對外請求的逾時上限，實際逾時為此上限與事件剩餘時間取較小者
+LINE_API_TIMEOUT = float(os.environ.get('LINE_API_TIMEOUT', 5))
+CALENDAR_TIMEOUT = float(os.environ.get('CALENDAR_TIMEOUT', 10))
+# 執行可能超過回覆期限的處理（行事曆查詢、新增及刪除預約），見 init_worker_state
+task_executor = None
+
+def reply_to(event, messages):
+    """在剩餘期限內回覆，reply token 已失效、來不及使用或回覆失敗時改用推播，避免訊息遺失"""
+    line_bot_api = current_tenant().line_bot_api
+    deadline = current_deadline() or event.deadline
+    if deadline is not None and deadline.remaining() <= REPLY_RESERVE_SECONDS:
+        # 延遲或重送的事件已沒有時間回覆，直接推播（不要以接近0秒的逾時嘗試回覆）
+        logger.warning(f"用戶 {event.user_id} 的事件已超過回覆期限，改用推播")
+        line_bot_api.push_message(event.user_id, messages, timeout=LINE_API_TIMEOUT)
+        return
+    try:
+        line_bot_api.reply_message(event.reply_token, messages, timeout=budget(LINE_API_TIMEOUT))
+    except (LineBotApiError, requests.RequestException) as e:
+        logger.warning(f"回覆用戶 {event.user_id} 失敗，改用推播: {str(e)}")
+        line_bot_api.push_message(event.user_id, messages, timeout=LINE_API_TIMEOUT)
+
+def submit_in_context(executor, func, *args):
+    """在執行緒池中執行 func，並帶入目前的店家及回覆期限"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+def _run_with_deadline(deadline, work):
+    with deadline_scope(deadline):
+        return work()
+
+def _push_deferred_result(tenant, user_id, future):
+    """背景工作完成後以推播送出結果"""
+    try:
+        messages = future.result()
+    except Exception as e:
+        logger.error(f"用戶 {user_id} 的背景處理失敗: {str(e)}")
+        messages = tenant.catalog_store.get().message('error')
+    try:
+        tenant.line_bot_api.push_message(user_id, messages, timeout=LINE_API_TIMEOUT)
+        logger.info(f"已推播背景處理結果給用戶 {user_id}")
+    except Exception as e:
+        logger.error(f"推播背景處理結果給用戶 {user_id} 時出錯: {str(e)}")
+
+def reply_within_deadline(event, work):
+    """在回覆期限內執行 work（回傳要送出的訊息）並回覆
+    
+    work 在期限內完成時直接回覆結果；快到期時先回覆處理中訊息，
+    work 繼續在背景執行（最多再 ASYNC_GRACE_SECONDS 秒），完成後以推播送出結果。
+    事件送達時已超過回覆期限則不回覆，只推播結果。
+    """
+    tenant = current_tenant()
+    deadline = event.deadline or Deadline.after(REPLY_DEADLINE_SECONDS)
+    # 背景工作至少有 ASYNC_GRACE_SECONDS 秒，延遲送達（例如重送）的事件不會一開始就沒有時間
+    work_deadline = deadline.extended(ASYNC_GRACE_SECONDS)
+    if work_deadline.remaining() < ASYNC_GRACE_SECONDS:
+        work_deadline = Deadline.after(ASYNC_GRACE_SECONDS)
+    future = submit_in_context(task_executor, _run_with_deadline, work_deadline, work)
+    if deadline.remaining() <= REPLY_RESERVE_SECONDS:
+        # reply token 已失效或來不及使用，不送處理中訊息，完成後直接推播結果
+        logger.warning(f"用戶 {event.user_id} 的事件已超過回覆期限，處理完成後以推播送出結果")
+        future.add_done_callback(lambda f: _push_deferred_result(tenant, event.user_id, f))
+        return
+    try:
+        messages = future.result(timeout=max(0.0, deadline.remaining() - REPLY_RESERVE_SECONDS))
+    except FuturesTimeout:
+        logger.warning(f"用戶 {event.user_id} 的請求即將超過回覆期限，先回覆處理中訊息")
+        reply_to(event, get_catalog().message('processing'))
+        future.add_done_callback(lambda f: _push_deferred_result(tenant, event.user_id, f))
+        return
+    reply_to(event, messages)
+
+def execute_calendar_request(make_request):
+    """在行事曆執行緒池中執行 Google Calendar 請求，最多等待目前事件的剩餘時間
+    
+    Args:
+        make_request: 接收行事曆服務並回傳 API 請求物件的函數
+    """
+    def wait_for_result():
+        future = submit_in_context(calendar_executor, lambda: make_request(get_thread_calendar_service()).execute())
+        try:
+            return future.result(timeout=budget(CALENDAR_TIMEOUT))
+        except FuturesTimeout:
+            future.cancel()
+            raise TimeoutError("Google Calendar 請求逾時")
+    
+    # 斷路器開啟時立即失敗，不佔用執行緒等待
+    return current_tenant().calendar_breaker.call(wait_for_result)
+
+# 事件處理函數登記表，鍵為 WebhookEvent.kind（例如 'message:text'、'postback'、'follow'）
+event_handlers = {}
+
+def on_event(kind):
+    """登記事件處理函數的裝飾器"""
+    def decorator(func):
+        event_handlers[kind] = func
+        return func
+    return decorator
+
+def sign_postback(*fields):
+    """以目前店家的 Channel Secret 簽章Postback資料"""
+    return current_tenant().sign_postback(*fields)
+
+def verify_postback(data):
+    """驗證Postback資料的簽章，成功時回傳欄位列表，否則回傳None"""
+    payload, _, signature = data.rpartition("|")
+    if not payload or len(signature) != POSTBACK_SIGNATURE_LENGTH:
+        return None
+    if not hmac.compare_digest(sign_postback(payload).encode('utf-8'), data.encode('utf-8')):
+        return None
+    return payload.split("|")
+
+def get_catalog():
+    """取得目前店家的服務目錄快照"""
+    return current_tenant().catalog_store.get()
+
+# 預約資訊及各美甲師在本地已被預約的時段保存在 current_tenant().records (實際應用建議使用資料庫)
+
+# 依 webhook 的 destination 分派到店家，也可用 /callback/<店家ID> 直接指定
+@bot_bp.route("/callback", methods=['POST'], strict_slashes=False)
+@bot_bp.route("/callback/<tenant_id>", methods=['POST'])
+def callback(tenant_id=None):
+    webhook_logger.debug("收到 /callback 請求，方法: %s, 路徑: %s, 頭部: %s", request.method, request.path, request.headers)
     try:
         # 取得 X-Line-Signature header 值
         signature = request.headers['X-Line-Signature']
 
-        # 取得請求內容
-        body = request.get_data(as_text=True)
-        logger.info(f"收到webhook請求: {body[:100]}...")  # 只記錄前100個字符避免日誌過大
+        # 取得原始請求內容，直接以位元組驗證簽名及解析，不另外解碼成文字
+        body = request.get_data()
+
+        resolved = []
+
+        def secret_for(destination):
+            tenant = tenant_registry.get(tenant_id or tenant_registry.resolve(destination))
+            if tenant is None:
+                return None
+            resolved.append(tenant)
+            return tenant.channel_secret.encode('utf-8')
 
-        # 處理 webhook
         try:
-            handler.handle(body, signature)
-        except InvalidSignatureError:
-            logger.error("無效的簽名")
+            events = parse_events(body, signature, secret_for)
+        except InvalidSignatureError as e:
+            logger.error(f"無效的簽名: {str(e)}")
             abort(400)
-        except Exception as e:
-            logger.error(f"處理webhook時發生錯誤: {str(e)}")
-            # 不中斷請求，返回 OK
+        tenant = resolved[0]
+        webhook_logger.info("收到店家 %s 的webhook請求: %d 個事件, %d bytes", tenant.tenant_id, len(events), len(body))
+        if webhook_logger.isEnabledFor(logging.DEBUG):
+            webhook_logger.debug("webhook內容: %s", body[:200].decode('utf-8', 'replace'))
+
+        # 新加入的好友一次在背景預先取得個人資料
+        follower_ids = [event.user_id for event in events if event.kind == 'follow']
+        if follower_ids:
+            tenant.profile_cache.prefetch(follower_ids)
+
+        # 處理 webhook
+        for event in events:
+            event_handler = event_handlers.get(event.kind)
+            if event_handler is None:
+                continue
+            # 每個事件依 webhook 時間戳計算回覆期限，對外請求以剩餘時間為逾時
+            event.deadline = Deadline.from_webhook_timestamp(event.timestamp, REPLY_DEADLINE_SECONDS)
+            event.tenant = tenant
+            try:
+                with tenant_scope(tenant), deadline_scope(event.deadline):
+                    event_handler(event)
+            except Exception as e:
+                logger.error(f"處理webhook事件 {event.kind} 時發生錯誤: {str(e)}")
+                # 不中斷請求，繼續處理其他事件
             
         return 'OK'
+    except werkzeug.exceptions.HTTPException:
+        # abort(400) 等HTTP錯誤直接回傳給LINE平台
+        raise
     except Exception as e:
         logger.error(f"回呼函數發生錯誤: {str(e)}")
         return 'Error', 500
 
 # 檢查Google行事曆是否有衝突
-def check_google_calendar(date_str, time_str):
+def check_google_calendar(date_str, time_str, manicurist_id=None, duration=30):
     """檢查指定日期和時間是否在Google日曆中有衝突
     
     Args:
         date_str: 日期字符串，格式為'YYYY-MM-DD'
         time_str: 時間字符串，格式為'HH:MM'
+        manicurist_id: 美甲師ID，指定時檢查該美甲師的行事曆
+        duration: 服務所需的分鐘數
         
     Returns:
         bool: 如果有衝突返回True，否則返回False
         如果查詢失敗，拋出異常
     """
     try:
-        logger.info(f"檢查日期時間是否有衝突: {date_str} {time_str}")
+        logger.info("檢查日期時間是否有衝突: %s %s", date_str, time_str)
         
         # 檢查是否可使用Google API
-        if not GOOGLE_CALENDAR_AVAILABLE or calendar_service is None:
+        if not calendar_available():
             logger.error("Google Calendar API 不可用，無法檢查行事曆")
             raise Exception("Google Calendar API 不可用，無法檢查行事曆")
         
-        calendar_id = os.environ.get('GOOGLE_CALENDAR_ID')
+        calendar_id = get_calendar_id(manicurist_id)
         if not calendar_id:
-            logger.error("未設置 GOOGLE_CALENDAR_ID 環境變量")
-            raise Exception("未設置 GOOGLE_CALENDAR_ID 環境變量")
+            logger.error("未設置店家的行事曆ID（GOOGLE_CALENDAR_ID 環境變量或 calendar_id 設定）")
+            raise Exception("未設置店家的行事曆ID")
         
         # 計算時間範圍
         start_time = f"{date_str}T{time_str}:00+08:00"  # 台灣時區
         end_time = datetime.fromisoformat(f"{date_str}T{time_str}:00")
-        end_time = end_time + timedelta(minutes=30)  # 預約時間為30分鐘
+        end_time = end_time + timedelta(minutes=duration)
         end_time = end_time.isoformat() + "+08:00"
         
-        logger.info(f"檢查Google日曆從 {start_time} 到 {end_time}")
+        logger.debug("檢查Google日曆從 %s 到 %s", start_time, end_time)
         
         # 查詢行事曆
-        events_result = calendar_service.events().list(
+        events_result = execute_calendar_request(lambda service: service.events().list(
             calendarId=calendar_id,
             timeMin=start_time,
             timeMax=end_time,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
+        ))
         
         events = events_result.get('items', [])
+        # 共用的行事曆中，其他美甲師的預約及休息事件不算衝突
+        if manicurist_id and calendar_is_shared(calendar_id):
+            events = [event for event in events if event_owner(event) in (None, str(manicurist_id))]
         
         # 如果有任何事件，則表示有衝突
         if events:
@@ -236,19 +479,281 @@ def check_google_calendar(date_str, time_str):
             logger.info(f"在 {date_str} {time_str} 找到衝突: {', '.join(event_info)}")
             return True
         
-        logger.info(f"Google日曆查詢顯示日期時間 {date_str} {time_str} 沒有衝突")
+        logger.info("Google日曆查詢顯示日期時間 %s %s 沒有衝突", date_str, time_str)
         return False
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"檢查Google行事曆時出錯: {str(e)}")
         raise Exception(f"行事曆查詢失敗，請聯絡工程師修改: {str(e)}")
 
+# 取得美甲師對應的行事曆ID
+def get_calendar_id(manicurist_id=None, default=None):
+    """回傳目前店家中美甲師的行事曆ID
+    
+    依序使用店家設定的 manicurist_calendar_ids（單一店家時為 GOOGLE_CALENDAR_ID_<美甲師ID> 環境變量）、
+    服務目錄中的 calendar_id，都未設置或未指定美甲師時使用店家共用的行事曆
+    （單一店家時為 GOOGLE_CALENDAR_ID）。
+    """
+    tenant = current_tenant()
+    if manicurist_id:
+        calendar_id = (
+            tenant.manicurist_calendar_ids.get(manicurist_id)
+            or get_catalog().manicurists.get(manicurist_id, {}).get('calendar_id')
+        )
+        if calendar_id:
+            return calendar_id
+    return tenant.calendar_id or default
+
+def calendar_available():
+    """目前店家可以使用 Google Calendar（有店家自己的或共用的憑證）"""
+    return current_tenant().google_credentials is not None or google_credentials is not None
+
+# 查詢可用時段時所用的執行緒池，限制同時對Google發出的請求數，見 init_worker_state
+calendar_executor = None
+_calendar_local = None
+
+def get_thread_calendar_service():
+    """googleapiclient 的 http 物件不是執行緒安全的，每個執行緒各自建立一個服務
+    
+    使用共用憑證的店家共用同一個服務，有自己憑證的店家另外建立。
+    """
+    tenant = current_tenant()
+    if tenant.google_credentials is not None:
+        local, credentials = tenant.calendar_local, tenant.google_credentials
+    else:
+        local, credentials = _calendar_local, google_credentials
+    service = getattr(local, 'service', None)
+    if service is None:
+        service = build('calendar', 'v3', credentials=credentials, cache_discovery=False)
+        local.service = service
+    return service
+
+def is_calendar_failure(exc):
+    """Google 回傳 4xx（429除外）代表請求本身有誤，不計入斷路器的錯誤率"""
+    status = getattr(getattr(exc, 'resp', None), 'status', None)
+    if status is not None and 400 <= int(status) < 500 and int(status) != 429:
+        return False
+    return True
+
+def build_calendar_breaker(tenant):
+    """建立店家的 Google Calendar 斷路器（Tenant.calendar_breaker），店家的所有行事曆請求都經過此斷路器"""
+    breaker = CircuitBreaker(
+        f'Google Calendar ({tenant.tenant_id})',
+        window_seconds=float(os.environ.get('CALENDAR_BREAKER_WINDOW', 60)),
+        min_calls=int(os.environ.get('CALENDAR_BREAKER_MIN_CALLS', 5)),
+        error_rate_threshold=float(os.environ.get('CALENDAR_BREAKER_ERROR_RATE', 0.5)),
+        slow_call_seconds=float(os.environ.get('CALENDAR_BREAKER_SLOW_SECONDS', 3)),
+        slow_call_rate_threshold=float(os.environ.get('CALENDAR_BREAKER_SLOW_RATE', 0.5)),
+        open_seconds=float(os.environ.get('CALENDAR_BREAKER_OPEN_SECONDS', 30)),
+        is_failure=is_calendar_failure
+    )
+    breaker.listeners.append(lambda old_state, new_state: on_calendar_breaker_change(tenant, old_state, new_state))
+    return breaker
+
+# 每間店最多保留的最近一次成功查詢到的忙碌區間數（current_tenant().last_known_busy），斷路器開啟時用來回答可用時段
+LAST_KNOWN_BUSY_MAX = 1024
+
+def queue_calendar_write(func, *args):
+    """斷路器開啟時把寫入操作排入店家的佇列（保存在預約紀錄中，店家被釋放時不會遺失），恢復後再寫入Google日曆"""
+    pending = current_tenant().pending_calendar_writes
+    pending.append((func, args))
+    logger.warning(f"Google Calendar 暫時無法使用，已延後寫入 {func.__name__}（佇列中 {len(pending)} 筆）")
+
+def flush_pending_calendar_writes(tenant):
+    """依序補寫店家延後的行事曆操作，斷路器再次開啟時停止（未完成的操作由函數自行重新排入）"""
+    pending = tenant.pending_calendar_writes
+    while pending and tenant.calendar_breaker.state == CLOSED:
+        func, args = pending.popleft()
+        try:
+            with tenant_scope(tenant):
+                func(*args)
+        except Exception as e:
+            logger.error(f"補寫店家 {tenant.tenant_id} 延後的行事曆操作 {func.__name__} 失敗: {str(e)}")
+
+def on_calendar_breaker_change(tenant, old_state, new_state):
+    if new_state == CLOSED and tenant.pending_calendar_writes:
+        logger.info(f"店家 {tenant.tenant_id} 的 Google Calendar 已恢復，開始補寫 {len(tenant.pending_calendar_writes)} 筆延後的操作")
+        task_executor.submit(flush_pending_calendar_writes, tenant)
+
+def event_owner(event):
+    """本系統建立的預約及休息事件所屬的美甲師ID，其他事件返回None"""
+    private = event.get('extendedProperties', {}).get('private', {})
+    if private.get('kind') in ('booking', 'block'):
+        return private.get('manicurist_id') or None
+    return None
+
+def calendar_is_shared(calendar_id):
+    """目前店家中是否有多位美甲師使用同一個行事曆（例如只設置 GOOGLE_CALENDAR_ID）"""
+    return sum(1 for manicurist_id in get_catalog().manicurists if get_calendar_id(manicurist_id) == calendar_id) > 1
+
+def fetch_busy_periods(calendar_id, date_str):
+    """一次查詢行事曆當天的所有事件
+    
+    Returns:
+        list: 忙碌區間 [(開始, 結束, 佔用的資源單位, 所屬美甲師ID), ...]，資源單位來自預約事件的
+        extendedProperties（例如 ('chair-1', 'uv_lamp-2')），其他事件只佔用美甲師；
+        所屬美甲師ID見 event_owner
+    """
+    day_start = datetime.fromisoformat(f"{date_str}T00:00:00+08:00")
+    day_end = day_start + timedelta(days=1)
+    
+    events_result = current_tenant().calendar_breaker.call(get_thread_calendar_service().events().list(
+        calendarId=calendar_id,
+        timeMin=day_start.isoformat(),
+        timeMax=day_end.isoformat(),
+        singleEvents=True,
+        orderBy='startTime'
+    ).execute)
+    
+    busy_periods = []
+    for event in events_result.get('items', []):
+        if event.get('transparency') == 'transparent':
+            continue
+        if 'dateTime' in event['start']:
+            start = dateutil.parser.isoparse(event['start']['dateTime'])
+            end = dateutil.parser.isoparse(event['end']['dateTime'])
+        else:
+            # 全天事件，整天都視為忙碌
+            start, end = day_start, day_end
+        private = event.get('extendedProperties', {}).get('private', {})
+        resources = tuple(unit for unit in private.get('resources', '').split(',') if unit)
+        busy_periods.append((start, end, resources, event_owner(event)))
+    return busy_periods
+
+def minutes_into_day(day_start, moment, round_up=False):
+    """把有時區的時間轉成當天0點起算的分鐘數，超出當天的部分截到0或1440"""
+    seconds = (moment - day_start).total_seconds()
+    minutes = -int(-seconds // 60) if round_up else int(seconds // 60)
+    return max(0, min(24 * 60, minutes))
+
+def build_day_schedule(date_str, availability, user_id=None):
+    """依各美甲師的忙碌區間、本地預約及候補保留時段建立當天的資源排程（不需查詢行事曆）
+    
+    查詢失敗的美甲師不列入排程，因此不會提供其時段；
+    保留給候補客戶的時段只對被通知的客戶（user_id）開放。
+    """
+    catalog = get_catalog()
+    business_hours = catalog.business_hours
+    schedule = DaySchedule(
+        [manicurist_id for manicurist_id, entry in availability.items() if not entry['error']],
+        catalog.resources,
+        open_minute=business_hours['start'] * 60,
+        close_minute=business_hours['end'] * 60,
+        step=business_hours.get('slot_step', 30)
+    )
+    
+    day_start = datetime.fromisoformat(f"{date_str}T00:00:00+08:00")
+    for manicurist_id, entry in availability.items():
+        for start, end, resources in entry['busy']:
+            schedule.block(
+                manicurist_id,
+                minutes_into_day(day_start, start),
+                minutes_into_day(day_start, end, round_up=True),
+                resources
+            )
+    
+    # 尚未出現在行事曆查詢結果中的本地預約（同一預約重複標記不影響結果）
+    tenant = current_tenant()
+    prefix = f"{date_str} "
+    for manicurist_id, local_calendar in list(tenant.manicurist_calendars.items()):
+        for slot_key, booking in list(local_calendar.items()):
+            if slot_key.startswith(prefix):
+                start = parse_minute(slot_key[len(prefix):])
+                schedule.block(manicurist_id, start, start + booking['duration'], booking['resources'])
+    for manicurist_id, start, end in tenant.waitlist.held_intervals(date_str, user_id):
+        schedule.block(manicurist_id, start, end)
+    return schedule
+
+def check_availability_for_date(date_str, timeout=None):
+    """同時查詢所有美甲師的行事曆，回傳每位美甲師當天的忙碌區間
+    
+    每個行事曆只發出一次查詢（共用同一行事曆的美甲師共用查詢結果），並透過有上限的執行緒池併發執行，
+    總耗時約等於最慢的一次查詢，而不是所有查詢的總和。
+    
+    Args:
+        date_str: 日期字符串，格式為'YYYY-MM-DD'
+        timeout: 等待所有查詢完成的最長秒數，None表示使用目前事件的剩餘時間
+        
+    Returns:
+        dict: {美甲師ID: {'name': 姓名, 'busy': [(開始, 結束, 資源單位), ...], 'error': 錯誤訊息或None}}
+        可預約的時段依服務而不同，由 build_day_schedule 建立排程後計算
+    """
+    if not calendar_available():
+        logger.error("Google Calendar API 不可用，無法查詢可用時段")
+        raise Exception("Google Calendar API 不可用，無法查詢可用時段")
+    
+    tenant = current_tenant()
+    manicurists = get_catalog().manicurists
+    # 多位美甲師共用同一個行事曆時只查詢一次
+    calendar_ids = {manicurist_id: get_calendar_id(manicurist_id) for manicurist_id in manicurists}
+    sharing = defaultdict(list)
+    for manicurist_id, calendar_id in calendar_ids.items():
+        if calendar_id:
+            sharing[calendar_id].append(manicurist_id)
+    futures = {
+        calendar_id: submit_in_context(calendar_executor, fetch_busy_periods, calendar_id, date_str)
+        for calendar_id in sharing
+    }
+    if timeout is None:
+        timeout = budget(CALENDAR_TIMEOUT)
+    done, not_done = wait(futures.values(), timeout=timeout)
+    
+    availability = {}
+    for manicurist_id, calendar_id in calendar_ids.items():
+        entry = {'name': manicurists[manicurist_id]['name'], 'busy': [], 'error': None}
+        future = futures.get(calendar_id)
+        if future is None:
+            entry['error'] = f"美甲師 {manicurist_id} 未設置行事曆ID"
+            logger.error(entry['error'])
+        elif future in not_done:
+            future.cancel()
+            entry['error'] = "查詢逾時"
+            logger.warning(f"查詢美甲師 {manicurist_id} 於 {date_str} 的行事曆逾時")
+        else:
+            try:
+                # 共用的行事曆中，預約及休息事件只佔用事件所屬的美甲師，其他事件佔用所有共用的美甲師
+                shared = len(sharing[calendar_id]) > 1
+                busy_periods = [
+                    (start, end, resources)
+                    for start, end, resources, owner in future.result()
+                    if not shared or owner is None or owner == manicurist_id
+                ]
+                with tenant.last_known_busy_lock:
+                    tenant.last_known_busy[(manicurist_id, date_str)] = busy_periods
+                    tenant.last_known_busy.move_to_end((manicurist_id, date_str))
+                    while len(tenant.last_known_busy) > LAST_KNOWN_BUSY_MAX:
+                        tenant.last_known_busy.popitem(last=False)
+                entry['busy'] = busy_periods
+            except CircuitOpenError:
+                # 降級模式：以最近一次成功查詢的結果加上本地預約回答
+                with tenant.last_known_busy_lock:
+                    busy_periods = tenant.last_known_busy.get((manicurist_id, date_str))
+                if busy_periods is None:
+                    entry['error'] = "行事曆暫時無法使用"
+                else:
+                    entry['busy'] = busy_periods
+                    entry['degraded'] = True
+            except Exception as e:
+                entry['error'] = str(e)
+                logger.error(f"查詢美甲師 {manicurist_id} 於 {date_str} 的行事曆失敗: {str(e)}")
+        availability[manicurist_id] = entry
+    
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s 各美甲師忙碌區間數: %s", date_str, ", ".join(
+            f"{entry['name']}={len(entry['busy'])}" for entry in availability.values()
+        ))
+    return availability
+
 # 處理文字消息
-@handler.add(MessageEvent, message=TextMessage)
+@on_event('message:text')
 def handle_text_message(event):
     try:
-        text = event.message.text
-        user_id = event.source.user_id
-        logger.info(f"收到來自用戶 {user_id} 的文字消息: {text}")
+        text = event.text
+        user_id = event.user_id
+        bookings = event.tenant.bookings
+        catalog = get_catalog()
+        logger.info("收到來自用戶 %s 的文字消息: %s", user_id, text)
         
         # 檢查是否正在處理中
         if user_id in bookings and 'processing' in bookings[user_id] and bookings[user_id]['processing']:
@@ -262,56 +767,8 @@ def handle_text_message(event):
                 bookings[user_id] = {}
             bookings[user_id]['processing'] = True
             
-            # 顯示服務選項
-            carousel_template = CarouselTemplate(
-                columns=[
-                    CarouselColumn(
-                        thumbnail_image_url="https://example.com/nail_art1.jpg",
-                        title="基礎美甲服務",
-                        text="選擇您想要的基礎美甲服務",
-                        actions=[
-                            PostbackTemplateAction(
-                                label="基礎凝膠",
-                                data="service_基礎凝膠"
-                            ),
-                            PostbackTemplateAction(
-                                label="基礎保養",
-                                data="service_基礎保養"
-                            ),
-                            PostbackTemplateAction(
-                                label="卸甲服務",
-                                data="service_卸甲服務"
-                            )
-                        ]
-                    ),
-                    CarouselColumn(
-                        thumbnail_image_url="https://example.com/nail_art2.jpg",
-                        title="進階美甲服務",
-                        text="選擇您想要的進階美甲服務",
-                        actions=[
-                            PostbackTemplateAction(
-                                label="法式凝膠",
-                                data="service_法式凝膠"
-                            ),
-                            PostbackTemplateAction(
-                                label="漸層凝膠",
-                                data="service_漸層凝膠"
-                            ),
-                            PostbackTemplateAction(
-                                label="鑽飾設計",
-                                data="service_鑽飾設計"
-                            )
-                        ]
-                    )
-                ]
-            )
-            
-            template_message = TemplateSendMessage(
-                alt_text='美甲服務選擇',
-                template=carousel_template
-            )
-            
-            line_bot_api.reply_message(event.reply_token, template_message)
+            # 顯示服務選項（預先編譯好的輪播訊息）
+            reply_to(event, catalog.message('service_carousel'))
             
             # 重置處理中標記
             bookings[user_id]['processing'] = False
@@ -324,43 +781,14 @@ def handle_text_message(event):
             bookings[user_id]['processing'] = True
             
             if user_id in bookings and 'date' in bookings[user_id] and 'time' in bookings[user_id]:
-                booking_info = bookings[user_id]
-                date_str = booking_info['date']
-                time_str = booking_info['time']
-                
-                # 嘗試從Google日曆刪除事件
-                if GOOGLE_CALENDAR_AVAILABLE:
-                    try:
-                        delete_result = delete_event_from_calendar(date_str, time_str)
-                        if delete_result:
-                            logger.info(f"已從Google日曆刪除預約: {date_str} {time_str}")
-                        else:
-                            logger.warning(f"無法從Google日曆刪除預約: {date_str} {time_str}")
-                    except Exception as e:
-                        logger.error(f"刪除Google日曆事件時出錯: {str(e)}")
-                
-                # 從美甲師的日曆中移除預約
-                if 'manicurist_id' in booking_info:
-                    manicurist_id = booking_info['manicurist_id']
-                    datetime_str = f"{date_str} {time_str}"
-                    if manicurist_id in manicurists and datetime_str in manicurists[manicurist_id]['calendar']:
-                        del manicurists[manicurist_id]['calendar'][datetime_str]
-                
-                # 清除預約信息
-                del bookings[user_id]
-                
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text="您的預約已成功取消。期待您的下次光臨！")
-                )
+                # 刪除Google日曆事件可能較慢，交由回覆期限控制
+                reply_within_deadline(event, lambda: cancel_booking(user_id))
             else:
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text="您目前沒有完整的預約信息。如需預約，請輸入「預約」。")
-                )
+                reply_to(event, catalog.message('cancel_no_booking'))
             
-            # 重置處理中標記
-            bookings[user_id]['processing'] = False
+            # 重置處理中標記（取消成功時預約資訊已被清除）
+            if user_id in bookings:
+                bookings[user_id]['processing'] = False
         
         # 處理查詢預約的請求
         elif text == "查詢預約" or text == "我的預約":
@@ -371,86 +799,580 @@ def handle_text_message(event):
             
             if user_id in bookings and 'date' in bookings[user_id] and 'time' in bookings[user_id]:
                 booking_info = bookings[user_id]
-                manicurist_name = booking_info.get('manicurist_name', '未指定')
                 manicurist_id = booking_info.get('manicurist_id', '未指定')
-                title = "闆娘" if manicurist_id == '1' else manicurists.get(manicurist_id, {}).get('title', '')
-                
-                confirmation_message = (
-                    f"🔍 您的預約信息如下:\n\n"
-                    f"✨ 美甲師: {manicurist_name} {title}\n"
-                    f"💅 服務: {booking_info.get('category', '')} - {booking_info.get('service', '未指定')}\n"
-                    f"📅 日期: {booking_info['date']}\n"
-                    f"🕒 時間: {booking_info['time']}\n\n"
-                    f"如需變更，請輸入「取消預約」後重新預約。"
-                )
                 
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=confirmation_message)
+                reply_to(
+                    event,
+                    catalog.text(
+                        'booking_summary',
+                        manicurist_name=booking_info.get('manicurist_name', '未指定'),
+                        title=catalog.manicurists.get(manicurist_id, {}).get('title', ''),
+                        category=booking_info.get('category', ''),
+                        service=booking_info.get('service', '未指定'),
+                        date=booking_info['date'],
+                        time=booking_info['time']
+                    )
                 )
             else:
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text="您目前沒有預約。如需預約，請輸入「預約」。")
-                )
+                reply_to(event, catalog.message('query_no_booking'))
             
             # 重置處理中標記
             bookings[user_id]['processing'] = False
         
         # 處理其他文字消息
         else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="您好！如需預約美甲服務，請輸入「預約」。\n如需查詢預約，請輸入「查詢預約」。\n如需取消預約，請輸入「取消預約」。")
-            )
+            reply_to(event, catalog.message('help'))
     
     except Exception as e:
         logger.error(f"處理文字消息時發生錯誤: {str(e)}")
         try:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="很抱歉，處理您的訊息時發生錯誤，請稍後再試。")
+            reply_to(event, get_catalog().message('error'))
+        except Exception as inner_e:
+            logger.error(f"回覆錯誤訊息時發生異常: {str(inner_e)}")
+
+# 可用時段快取（每間店各自一份），同一天的查詢在有效期內直接使用快取結果
+AVAILABILITY_CACHE_TTL = int(os.environ.get('AVAILABILITY_CACHE_TTL', 60))
+
+def get_cached_availability(date_str):
+    """回傳當天各美甲師的忙碌區間，快取過期時才重新查詢行事曆"""
+    tenant = current_tenant()
+    now = time.monotonic()
+    with tenant.availability_cache_lock:
+        cached = tenant.availability_cache.get(date_str)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    availability = check_availability_for_date(date_str)
+    # 有查詢失敗或使用降級資料的美甲師時不寫入快取，下次重新查詢
+    if not any(entry['error'] or entry.get('degraded') for entry in availability.values()):
+        with tenant.availability_cache_lock:
+            tenant.availability_cache[date_str] = (now + AVAILABILITY_CACHE_TTL, availability)
+    return availability
+
+def invalidate_availability(date_str):
+    """預約或取消後清除當天的快取"""
+    tenant = current_tenant()
+    with tenant.availability_cache_lock:
+        tenant.availability_cache.pop(date_str, None)
+
+# LINE 輪播模板最多10欄、每欄最多3個按鈕
+CAROUSEL_MAX_COLUMNS = 10
+CAROUSEL_MAX_ACTIONS = 3
+SLOTS_PER_PAGE = (CAROUSEL_MAX_COLUMNS - 1) * CAROUSEL_MAX_ACTIONS  # 保留一欄放分頁按鈕
+
+# 可預約的日期範圍：今天起算的天數
+BOOKING_MAX_DAYS_AHEAD = 30
+
+def booking_date_range():
+    """可預約的第一天及最後一天 (YYYY-MM-DD)，以台灣時間計算"""
+    today = datetime.now(TAIPEI_TZ)
+    return today.strftime('%Y-%m-%d'), (today + timedelta(days=BOOKING_MAX_DAYS_AHEAD)).strftime('%Y-%m-%d')
+
+def earliest_start_minute(date_str):
+    """當天最早可開始的分鐘數：今天為現在之後，其他日期為0"""
+    now = datetime.now(TAIPEI_TZ)
+    if date_str != now.strftime('%Y-%m-%d'):
+        return 0
+    return now.hour * 60 + now.minute + 1
+
+def is_bookable(date_str, time_str=None):
+    """日期在可預約範圍內，且（指定時間時）時間尚未過去"""
+    first_day, last_day = booking_date_range()
+    if not first_day <= date_str <= last_day:
+        return False
+    return time_str is None or parse_minute(time_str) >= earliest_start_minute(date_str)
+
+def build_date_picker_action(service, label='選擇日期'):
+    """建立日期選擇按鈕，選擇後以簽章過的 'd|服務' 回傳"""
+    first_day, last_day = booking_date_range()
+    return DatetimePickerTemplateAction(
+        label=label,
+        data=sign_postback("d", service),
+        mode='date',
+        initial=first_day,
+        min=first_day,
+        max=last_day
+    )
+
+def build_date_unavailable_reply(service, date_str):
+    """選擇的日期已過或超出範圍時，請客戶重新選擇日期"""
+    return [TemplateSendMessage(
+        alt_text='請重新選擇日期',
+        template=ButtonsTemplate(
+            title='無法預約此日期',
+            # 有標題的按鈕模板文字最多60字
+            text=get_catalog().text_templates['date_unavailable'].format(
+                date=date_str, max_days=BOOKING_MAX_DAYS_AHEAD
+            )[:60],
+            actions=[build_date_picker_action(service, label='更換日期')]
+        )
+    )]
+
+def build_slot_options(schedule, service_spec, manicurists, earliest=0):
+    """列出服務當天所有可開始（不早於 earliest 分鐘）的時段，回傳依時間排序的 (時間, 美甲師ID, 姓名) 列表"""
+    return [
+        (format_minute(start), manicurist_id, manicurists[manicurist_id]['name'])
+        for start, manicurist_id in schedule.feasible_starts(service_spec)
+        if start >= earliest
+    ]
+
+def build_time_slot_page(service, date_str, options, page, duration):
+    """產生一頁可預約時段的輪播訊息"""
+    total_pages = (len(options) + SLOTS_PER_PAGE - 1) // SLOTS_PER_PAGE
+    page = max(0, min(page, total_pages - 1))
+    page_options = options[page * SLOTS_PER_PAGE:(page + 1) * SLOTS_PER_PAGE]
+    
+    # 每欄按鈕數必須相同，不足的以更換日期/重新選擇服務補齊
+    filler_actions = [
+        build_date_picker_action(service, label='更換日期'),
+        MessageTemplateAction(label='重新選擇服務', text='預約')
+    ]
+    
+    def pad(actions):
+        for i in range(CAROUSEL_MAX_ACTIONS - len(actions)):
+            actions.append(filler_actions[i % len(filler_actions)])
+        return actions
+    
+    columns = []
+    for i in range(0, len(page_options), CAROUSEL_MAX_ACTIONS):
+        chunk = page_options[i:i + CAROUSEL_MAX_ACTIONS]
+        actions = [
+            PostbackTemplateAction(
+                label=f"{time_str} {name}",
+                data=sign_postback("b", service, date_str, time_str, manicurist_id)
+            ) for time_str, manicurist_id, name in chunk
+        ]
+        columns.append(CarouselColumn(
+            title=f"{date_str} {chunk[0][0]} 起",
+            text=f"{service}（約{duration}分鐘）｜請選擇時段與美甲師",
+            actions=pad(actions)
+        ))
+    
+    if total_pages > 1:
+        nav_actions = []
+        if page > 0:
+            nav_actions.append(PostbackTemplateAction(
+                label='上一頁', data=sign_postback("p", service, date_str, page - 1)
+            ))
+        if page < total_pages - 1:
+            nav_actions.append(PostbackTemplateAction(
+                label='下一頁', data=sign_postback("p", service, date_str, page + 1)
+            ))
+        columns.append(CarouselColumn(
+            title=f"第 {page + 1}/{total_pages} 頁",
+            text='查看更多時段',
+            actions=pad(nav_actions)
+        ))
+    
+    return TemplateSendMessage(
+        alt_text=f'{date_str} 可預約時段',
+        template=CarouselTemplate(columns=columns)
+    )
+
+def build_time_slot_reply(service, date_str, page=0, notice=None, user_id=None):
+    """依快取的可用時段產生回覆訊息列表，當天額滿時提供候補選項
+    
+    只有所有美甲師的行事曆都查詢成功時才視為額滿；沒有時段且有美甲師查詢失敗時回覆暫時無法查詢。
+    """
+    if not is_bookable(date_str):
+        return build_date_unavailable_reply(service, date_str)
+    try:
+        availability = get_cached_availability(date_str)
+    except Exception as e:
+        logger.error(f"查詢 {date_str} 可用時段失敗: {str(e)}")
+        return [TextSendMessage(text="行事曆查詢失敗，請稍後再試。")]
+    
+    catalog = get_catalog()
+    service_spec = catalog.service(service)
+    schedule = build_day_schedule(date_str, availability, user_id)
+    messages = [TextSendMessage(text=notice)] if notice else []
+    options = build_slot_options(schedule, service_spec, catalog.manicurists, earliest_start_minute(date_str))
+    if options:
+        messages.append(build_time_slot_page(service, date_str, options, page, service_spec.duration))
+    elif any(entry['error'] for entry in availability.values()):
+        # 查詢失敗的美甲師不在排程中，可能仍有空檔，不能當作額滿
+        failed = [entry['name'] for entry in availability.values() if entry['error']]
+        logger.warning(f"{date_str} 沒有可預約的時段，但 {', '.join(failed)} 的行事曆查詢失敗")
+        messages.append(TextSendMessage(text="行事曆查詢失敗，請稍後再試。"))
+    else:
+        # 按鈕模板最多4個按鈕：更換日期及最多3個候補時段區間
+        waitlist_actions = [
+            PostbackTemplateAction(label=f'候補{name}', data=sign_postback("w", service, date_str, name))
+            for name, _, _ in catalog.waitlist_windows[:3]
+        ]
+        messages.append(TemplateSendMessage(
+            alt_text='請選擇其他日期或加入候補',
+            template=ButtonsTemplate(
+                title='此日期已額滿',
+                text=f'{date_str} 沒有可預約的時段，請選擇其他日期或加入候補',
+                actions=[build_date_picker_action(service, label='更換日期')] + waitlist_actions
             )
+        ))
+    return messages
+
+def reserve_slot(user_id, service, date_str, time_str, manicurist_id):
+    """預約前先在本地佔用美甲師及服務所需的資源，再向美甲師的Google行事曆確認仍然空閒
+    
+    椅子、UV燈等共用資源依快取的各美甲師行事曆及本地預約判斷，
+    美甲師本身的時段另外即時查詢一次行事曆。
+    
+    Returns:
+        dict: 成功佔用時回傳資源分配 {'stylist': 美甲師ID, 'resources': [...]}，
+        時段或資源已被預約返回None
+    """
+    tenant = current_tenant()
+    service_spec = get_catalog().service(service)
+    availability = get_cached_availability(date_str)
+    entry = availability.get(manicurist_id)
+    if entry is None:
+        return None
+    if entry['error']:
+        raise Exception(entry['error'])
+    
+    slot_key = f"{date_str} {time_str}"
+    local_calendar = tenant.manicurist_calendars[manicurist_id]
+    with tenant.booking_lock:
+        if slot_key in local_calendar:
+            return None
+        schedule = build_day_schedule(date_str, availability, user_id)
+        assignment = schedule.can_start(service_spec, parse_minute(time_str), manicurist_id)
+        if assignment is None:
+            return None
+        local_calendar[slot_key] = {
+            'user_id': user_id,
+            'service': service,
+            'duration': service_spec.duration,
+            'resources': assignment['resources']
+        }
+    
+    try:
+        conflict = check_google_calendar(date_str, time_str, manicurist_id, service_spec.duration)
+    except CircuitOpenError:
+        # 降級模式：上面已依最近一次查詢到的忙碌區間確認，預約的寫入會延後到行事曆恢復
+        conflict = False
+    except Exception:
+        local_calendar.pop(slot_key, None)
+        raise
+    if conflict:
+        local_calendar.pop(slot_key, None)
+        return None
+    return assignment
+
+def hours_until(date_str, time_str):
+    """現在距離預約開始的小時數"""
+    start = datetime.fromisoformat(f"{date_str}T{time_str}:00+08:00")
+    return (start - datetime.now(TAIPEI_TZ)).total_seconds() / 3600
+
+def get_existing_booking(user_id):
+    """客戶目前的預約，沒有時回傳None（只有處理中標記的紀錄不算預約）"""
+    booking = current_tenant().bookings.get(user_id)
+    if booking and 'date' in booking and 'time' in booking:
+        return booking
+    return None
+
+def complete_booking(user_id, service, date_str, time_str, manicurist_id):
+    """確認時段仍然空閒後完成預約並寫入Google日曆，回傳要送出的訊息
+    
+    每位客戶同時只能有一筆預約，已有預約時請客戶先取消，不覆蓋原本的預約。
+    """
+    tenant = current_tenant()
+    catalog = get_catalog()
+    # 從舊的時段選單按下時，日期或時間可能已經過去
+    if not is_bookable(date_str, time_str):
+        logger.info(f"用戶 {user_id} 選擇的時段已無法預約: {date_str} {time_str}")
+        return build_date_unavailable_reply(service, date_str)
+    existing = get_existing_booking(user_id)
+    if existing is not None:
+        return catalog.text('already_booked', date=existing['date'], time=existing['time'], service=existing.get('service', ''))
+    
+    assignment = reserve_slot(user_id, service, date_str, time_str, manicurist_id)
+    if assignment is None:
+        invalidate_availability(date_str)
+        return build_time_slot_reply(
+            service, date_str, notice="很抱歉，此時段剛被預約，請選擇其他時段。", user_id=user_id
+        )
+    
+    manicurist = catalog.manicurists[manicurist_id]
+    booking_data = {
+        'category': '美甲服務',
+        'service': service,
+        'date': date_str,
+        'time': time_str,
+        'duration': catalog.service(service).duration,
+        'resources': assignment['resources'],
+        'manicurist_id': manicurist_id,
+        'manicurist_name': manicurist['name']
+    }
+    with tenant.booking_lock:
+        existing = get_existing_booking(user_id)
+        if existing is None:
+            tenant.bookings[user_id] = booking_data
+        else:
+            # 同一客戶同時送出的另一筆預約已先完成，釋放剛佔用的時段
+            tenant.manicurist_calendars[manicurist_id].pop(f"{date_str} {time_str}", None)
+    if existing is not None:
+        invalidate_availability(date_str)
+        return catalog.text('already_booked', date=existing['date'], time=existing['time'], service=existing.get('service', ''))
+    tenant.waitlist.booked(date_str, user_id)
+    tenant.stats.record_booking(
+        date_str, time_str, manicurist_id, service, booking_data['duration'],
+        lead_hours=hours_until(date_str, time_str)
+    )
+    invalidate_availability(date_str)
+    
+    if not add_event_to_calendar(user_id, booking_data):
+        logger.warning(f"用戶 {user_id} 的預約未能寫入Google日曆: {date_str} {time_str}")
+    
+    return catalog.text(
+        'booking_confirmed',
+        manicurist_name=manicurist['name'],
+        title=manicurist.get('title', ''),
+        service=service,
+        date=date_str,
+        time=time_str
+    )
+
+def cancel_booking(user_id):
+    """取消用戶的預約並從Google日曆刪除，回傳要送出的訊息"""
+    tenant = current_tenant()
+    booking_info = tenant.bookings[user_id]
+    date_str = booking_info['date']
+    time_str = booking_info['time']
+    
+    # 嘗試從Google日曆刪除事件
+    if calendar_available():
+        try:
+            delete_result = delete_event_from_calendar(
+                date_str, time_str, booking_info.get('manicurist_id'), booking_info.get('duration'), user_id
+            )
+            if delete_result:
+                logger.info(f"已從Google日曆刪除預約: {date_str} {time_str}")
+            else:
+                logger.warning(f"無法從Google日曆刪除預約: {date_str} {time_str}")
+        except Exception as e:
+            logger.error(f"刪除Google日曆事件時出錯: {str(e)}")
+    
+    # 從美甲師的日曆中移除預約
+    if 'manicurist_id' in booking_info:
+        manicurist_id = booking_info['manicurist_id']
+        datetime_str = f"{date_str} {time_str}"
+        tenant.manicurist_calendars[manicurist_id].pop(datetime_str, None)
+    
+    # 清除預約信息
+    del tenant.bookings[user_id]
+    tenant.stats.record_cancellation(
+        date_str, time_str, booking_info.get('manicurist_id'),
+        booking_info.get('duration') or get_catalog().service(booking_info.get('service')).duration
+    )
+    invalidate_availability(date_str)
+    
+    # 在背景通知候補客戶，不延遲取消的回覆
+    if booking_info.get('manicurist_id'):
+        submit_in_context(
+            task_executor, notify_waitlist,
+            date_str, time_str, booking_info['manicurist_id'], booking_info.get('duration')
+        )
+    
+    return get_catalog().message('cancelled')
+
+# 候補：被通知的人數、保留時段的秒數，以及每次 multicast 的收件人上限（LINE 限制為500）
+WAITLIST_NOTIFY_COUNT = int(os.environ.get('WAITLIST_NOTIFY_COUNT', 3))
+WAITLIST_HOLD_SECONDS = int(os.environ.get('WAITLIST_HOLD_SECONDS', 900))
+MULTICAST_MAX_RECIPIENTS = 500
+
+def notify_waitlist(date_str, time_str, manicurist_id, duration=None):
+    """時段釋出後通知最早加入、且服務可在該時段開始的候補客戶，並為他們保留時段
+    
+    只查詢與釋出時段相關的候補佇列（該時段所在的時段區間 × 該美甲師或不指定美甲師），
+    同一服務的客戶以一次 multicast 通知。
+    """
+    # 在背景執行，不受取消預約事件的回覆期限限制
+    with deadline_scope(None):
+        tenant = current_tenant()
+        catalog = get_catalog()
+        start = parse_minute(time_str)
+        windows = catalog.windows_containing(start)
+        if not windows:
+            return
+        
+        try:
+            availability = get_cached_availability(date_str)
+        except Exception as e:
+            logger.error(f"查詢 {date_str} 可用時段失敗，無法通知候補客戶: {str(e)}")
+            return
+        schedule = build_day_schedule(date_str, availability)
+        waiters = tenant.waitlist.take(
+            date_str, windows, manicurist_id, WAITLIST_NOTIFY_COUNT,
+            accept=lambda waiter: schedule.can_start(catalog.service(waiter.service), start, manicurist_id) is not None
+        )
+        if not waiters:
+            return
+        
+        # 保留的長度取被通知客戶中最長的服務時間
+        end = start + max(catalog.service(waiter.service).duration for waiter in waiters)
+        if duration:
+            end = max(end, start + duration)
+        tenant.waitlist.hold(
+            date_str, manicurist_id, start, end,
+            [waiter.user_id for waiter in waiters], WAITLIST_HOLD_SECONDS
+        )
+        
+        by_service = defaultdict(list)
+        for waiter in waiters:
+            by_service[waiter.service].append(waiter.user_id)
+        manicurist_name = catalog.manicurists.get(manicurist_id, {}).get('name', '')
+        for service, user_ids in by_service.items():
+            message = TemplateSendMessage(
+                alt_text=f'候補時段釋出: {date_str} {time_str}',
+                template=ButtonsTemplate(
+                    title='候補時段釋出',
+                    text=(
+                        f"{date_str} {time_str} {manicurist_name}\n"
+                        f"{service}，為您保留 {WAITLIST_HOLD_SECONDS // 60} 分鐘"
+                    ),
+                    actions=[PostbackTemplateAction(
+                        label='立即預約',
+                        data=sign_postback("b", service, date_str, time_str, manicurist_id)
+                    )]
+                )
+            )
+            for i in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS):
+                batch = user_ids[i:i + MULTICAST_MAX_RECIPIENTS]
+                try:
+                    tenant.line_bot_api.multicast(batch, message, timeout=LINE_API_TIMEOUT)
+                    logger.info(f"已通知 {len(batch)} 位候補客戶 {date_str} {time_str} 的時段釋出")
+                except Exception as e:
+                    logger.error(f"通知候補客戶時出錯: {str(e)}")
+
+# 處理Postback事件（服務、日期、分頁及時段選擇）
+@on_event('postback')
+def handle_postback(event):
+    try:
+        user_id = event.user_id
+        fields = verify_postback(event.data)
+        if fields is None:
+            logger.warning(f"用戶 {user_id} 送出無效的Postback資料: {event.data}")
+            reply_to(event, TextSendMessage(text="此選項已失效，請輸入「預約」重新開始。"))
+            return
+        
+        action = fields[0]
+        logger.info("收到來自用戶 %s 的Postback: %s", user_id, fields)
+        
+        # 選擇服務後提供日期選擇
+        if action == "s":
+            service = fields[1]
+            # 預約確認前先在背景取得顯示名稱，寫入日曆時可直接命中快取
+            event.tenant.profile_cache.prefetch([user_id])
+            buttons_template = ButtonsTemplate(
+                title='選擇預約日期',
+                text=f'您選擇了: {service}\n請選擇預約日期',
+                actions=[build_date_picker_action(service)]
+            )
+            reply_to(event, TemplateSendMessage(alt_text='日期選擇', template=buttons_template))
+        
+        # 選擇日期後顯示第一頁可預約時段
+        elif action == "d":
+            service = fields[1]
+            date_str = event.params['date']
+            reply_within_deadline(event, lambda: build_time_slot_reply(service, date_str, user_id=user_id))
+        
+        # 切換時段分頁
+        elif action == "p":
+            _, service, date_str, page = fields
+            reply_within_deadline(
+                event, lambda: build_time_slot_reply(service, date_str, int(page), user_id=user_id)
+            )
+        
+        # 選擇時段及美甲師，完成預約
+        elif action == "b":
+            _, service, date_str, time_str, manicurist_id = fields
+            reply_within_deadline(
+                event,
+                lambda: complete_booking(user_id, service, date_str, time_str, manicurist_id)
+            )
+        
+        # 當天額滿時加入候補
+        elif action == "w":
+            _, service, date_str, window = fields
+            catalog = get_catalog()
+            position = event.tenant.waitlist.join(date_str, window, ANY_MANICURIST, user_id, service)
+            if position is None:
+                reply_to(event, catalog.text('waitlist_full', date=date_str, window=window))
+            else:
+                logger.info(f"用戶 {user_id} 加入 {date_str} {window} 的候補，第 {position} 位")
+                reply_to(event, catalog.text(
+                    'waitlist_joined',
+                    date=date_str,
+                    window=window,
+                    service=service,
+                    position=position,
+                    hold_minutes=WAITLIST_HOLD_SECONDS // 60
+                ))
+        
+        else:
+            logger.warning(f"未知的Postback動作: {action}")
+    
+    except Exception as e:
+        logger.error(f"處理Postback事件時發生錯誤: {str(e)}")
+        try:
+            reply_to(event, get_catalog().message('error'))
         except Exception as inner_e:
             logger.error(f"回覆錯誤訊息時發生異常: {str(inner_e)}")
 
 # 添加定時任務功能，用於發送預約提醒
 def send_appointment_reminder():
     """
-    檢查即將到來的預約並發送提醒
+    檢查所有店家即將到來的預約並發送提醒
     此函數應該由定時任務調用，例如每小時執行一次
     """
-    if not GOOGLE_CALENDAR_AVAILABLE or calendar_service is None:
+    for tenant_id in tenant_registry.tenant_ids():
+        try:
+            tenant = tenant_registry.get(tenant_id)
+        except Exception as e:
+            logger.error(f"載入店家 {tenant_id} 失敗，無法發送預約提醒: {str(e)}")
+            continue
+        with tenant_scope(tenant):
+            send_tenant_appointment_reminders()
+
+def send_tenant_appointment_reminders():
+    """檢查目前店家即將到來的預約並發送提醒"""
+    if not calendar_available():
         logger.error("Google Calendar API 不可用，無法檢查即將到來的預約")
         return
     
+    tenant = current_tenant()
+    
     try:
-        now = datetime.now()
+        # 與行事曆事件比較及查詢範圍都使用含時區的時間
+        now = datetime.now(TAIPEI_TZ)
         tomorrow = now + timedelta(days=1)
-        start_time = now.isoformat() + "Z"
-        end_time = tomorrow.isoformat() + "Z"
-        
-        calendar_id = os.environ.get('GOOGLE_CALENDAR_ID', 'primary')
-        
-        events_result = calendar_service.events().list(
-            calendarId=calendar_id,
-            timeMin=start_time,
-            timeMax=end_time,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        start_time = now.isoformat()
+        end_time = tomorrow.isoformat()
         
-        events = events_result.get('items', [])
+        # 預約分散在各美甲師的行事曆中，逐一查詢（重複的ID只查一次）
+        calendar_ids = {get_calendar_id(manicurist_id, 'primary') for manicurist_id in get_catalog().manicurists}
+        events = []
+        for calendar_id in calendar_ids:
+            events_result = execute_calendar_request(lambda service, calendar_id=calendar_id: service.events().list(
+                calendarId=calendar_id,
+                timeMin=start_time,
+                timeMax=end_time,
+                singleEvents=True,
+                orderBy='startTime'
+            ))
+            events.extend(events_result.get('items', []))
         
         for event in events:
             try:
                 # 從事件描述中提取用戶ID
                 description = event.get('description', '')
                 user_id_match = None
+                customer_name = None
                 for line in description.split('\n'):
                     if line.startswith('客戶 ID:'):
                         user_id_match = line.replace('客戶 ID:', '').strip()
-                        break
+                    elif line.startswith('客戶名稱:'):
+                        customer_name = line.replace('客戶名稱:', '').strip()
                 
                 if not user_id_match:
                     continue
@@ -461,7 +1383,7 @@ def send_appointment_reminder():
                     continue
                 
                 # 解析事件時間
-                event_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+                event_time = datetime.fromisoformat(start_time.replace('Z', '+00:00')).astimezone(TAIPEI_TZ)
                 
                 # 計算事件距離現在的時間
                 time_diff = event_time - now
@@ -472,15 +1394,20 @@ def send_appointment_reminder():
                     service_name = event.get('summary', '美甲服務')
                     event_time_str = event_time.strftime('%Y-%m-%d %H:%M')
                     
+                    # 舊的事件沒有記錄客戶名稱時才查詢（通常命中快取）
+                    if not customer_name or customer_name == '未知':
+                        customer_name = tenant.profile_cache.get(user_id_match)
+                    greeting = f"{customer_name} 您好，" if customer_name else ""
                     reminder_message = (
                         f"⏰ 預約提醒 ⏰\n\n"
+                        f"{greeting}"
                         f"您的{service_name}預約將在約 {int(hours_remaining)} 小時後開始。\n"
                         f"預約時間: {event_time_str}\n\n"
                         f"期待為您提供專業的美甲服務！"
                     )
                     
                     try:
-                        line_bot_api.push_message(
+                        tenant.line_bot_api.push_message(
                             user_id_match,
                             TextSendMessage(text=reminder_message)
                         )
@@ -495,58 +1422,81 @@ def send_appointment_reminder():
         logger.error(f"檢查即將到來的預約時出錯: {str(e)}")
 
 # 其他函數（保持不變）
+# 建立預約的日曆事件內容
+def build_booking_event(user_id, booking_data, customer_name):
+    date_str = booking_data['date']
+    time_str = booking_data['time']
+    service = booking_data.get('service', '美甲服務')
+    duration = booking_data.get('duration') or get_catalog().service(service).duration
+    resources = booking_data.get('resources', [])
+    
+    start_datetime = f"{date_str}T{time_str}:00+08:00"
+    end_time = datetime.fromisoformat(f"{date_str}T{time_str}:00")
+    end_time = end_time + timedelta(minutes=duration)
+    end_datetime = end_time.isoformat() + "+08:00"
+    
+    manicurist_name = booking_data.get('manicurist_name', '未指定')
+    manicurist_id = booking_data.get('manicurist_id', '未指定')
+    
+    return {
+        'summary': f"{service} 預約 - {manicurist_name}",
+        'location': '新北市永和區頂溪站1號出口附近',
+        'description': (
+            f"客戶 ID: {user_id or ''}\n"
+            f"客戶名稱: {customer_name}\n"
+            f"服務: {booking_data.get('service', '未指定')}\n"
+            f"美甲師: {manicurist_name} (ID: {manicurist_id})\n"
+            f"時間: {duration} 分鐘"
+        ),
+        'start': {
+            'dateTime': start_datetime,
+            'timeZone': 'Asia/Taipei',
+        },
+        'end': {
+            'dateTime': end_datetime,
+            'timeZone': 'Asia/Taipei',
+        },
+        'reminders': {
+            'useDefault': True,
+        },
+        # 查詢可用時段時依此還原佔用的椅子、UV燈等資源
+        'extendedProperties': {
+            'private': {
+                'kind': 'booking',
+                'service': service,
+                'resources': ','.join(resources),
+                'user_id': user_id or '',
+                'manicurist_id': str(manicurist_id),
+            },
+        },
+    }
+
 # 添加日曆事件
 def add_event_to_calendar(user_id, booking_data):
-    if not GOOGLE_CALENDAR_AVAILABLE or calendar_service is None:
+    if not calendar_available():
         logger.error("Google Calendar API 不可用，無法新增事件")
         return False
     
     try:
-        date_str = booking_data.get('date')
-        time_str = booking_data.get('time')
-        if not date_str or not time_str:
+        if not booking_data.get('date') or not booking_data.get('time'):
             logger.error("預約數據中缺少日期或時間")
             return False
         
-        start_datetime = f"{date_str}T{time_str}:00+08:00"
-        end_time = datetime.fromisoformat(f"{date_str}T{time_str}:00")
-        end_time = end_time + timedelta(minutes=30)
-        end_datetime = end_time.isoformat() + "+08:00"
-        
-        manicurist_name = booking_data.get('manicurist_name', '未指定')
-        manicurist_id = booking_data.get('manicurist_id', '未指定')
-        
-        event = {
-            'summary': f"{booking_data.get('service', '美甲服務')} 預約 - {manicurist_name}",
-            'location': '新北市永和區頂溪站1號出口附近',
-            'description': (
-                f"客戶 ID: {user_id}\n"
-                f"服務: {booking_data.get('service', '未指定')}\n"
-                f"美甲師: {manicurist_name} (ID: {manicurist_id})"
-            ),
-            'start': {
-                'dateTime': start_datetime,
-                'timeZone': 'Asia/Taipei',
-            },
-            'end': {
-                'dateTime': end_datetime,
-                'timeZone': 'Asia/Taipei',
-            },
-            'reminders': {
-                'useDefault': True,
-            },
-        }
+        customer_name = current_tenant().profile_cache.get(user_id, timeout=budget(2)) or '未知'
+        event = build_booking_event(user_id, booking_data, customer_name)
         
-        # 獲取日曆ID，如果環境變量未設置，則使用 'primary'
-        calendar_id = os.environ.get('GOOGLE_CALENDAR_ID', 'primary')
+        # 獲取美甲師的日曆ID，如果環境變量未設置，則使用 'primary'
+        calendar_id = get_calendar_id(booking_data.get('manicurist_id'), 'primary')
         
         # 嘗試插入事件前先記錄詳細信息
         logger.info(f"嘗試將事件添加到日曆 {calendar_id}，事件摘要: {event['summary']}")
         
         try:
             # 首先檢查服務帳戶是否有權限訪問該日曆
-            calendar_service.calendars().get(calendarId=calendar_id).execute()
+            execute_calendar_request(lambda service: service.calendars().get(calendarId=calendar_id))
             logger.info(f"成功訪問日曆 {calendar_id}")
+        except CircuitOpenError:
+            raise
         except Exception as cal_error:
             logger.error(f"無法訪問日曆 {calendar_id}: {str(cal_error)}")
             
@@ -556,181 +1506,651 @@ def add_event_to_calendar(user_id, booking_data):
                 calendar_id = 'primary'
         
         # 插入事件
-        event = calendar_service.events().insert(calendarId=calendar_id, body=event).execute()
+        event = execute_calendar_request(
+            lambda service, body=event: service.events().insert(calendarId=calendar_id, body=body)
+        )
         logger.info(f"成功新增日曆事件: ID={event.get('id')}, 標題={event.get('summary')}")
         return True
+    except CircuitOpenError:
+        queue_calendar_write(add_event_to_calendar, user_id, booking_data)
+        return True
     except Exception as e:
         logger.error(f"新增日曆事件失敗: {str(e)}")
         return False
 
 # 從Google日曆刪除事件
-def delete_event_from_calendar(date_str, time_str):
-    if not GOOGLE_CALENDAR_AVAILABLE or calendar_service is None:
+def is_booking_event(event, user_id, manicurist_id):
+    """事件是否為該客戶在該美甲師的預約
+    
+    以 extendedProperties 比對；沒有此記錄的舊事件改比對描述中的客戶ID，休息時段等其他事件一律不符合。
+    """
+    private = event.get('extendedProperties', {}).get('private', {})
+    if 'kind' in private or 'user_id' in private:
+        if private.get('kind', 'booking') != 'booking':
+            return False
+        if manicurist_id is not None and private.get('manicurist_id') != str(manicurist_id):
+            return False
+        return user_id is None or private.get('user_id') == user_id
+    return user_id is not None and f"客戶 ID: {user_id}\n" in event.get('description', '')
+
+def delete_event_from_calendar(date_str, time_str, manicurist_id=None, duration=None, user_id=None):
+    """刪除客戶在預約時間開始的日曆事件
+    
+    多位美甲師共用同一個行事曆時，同一時間可能有其他客戶的預約或休息時段，只刪除屬於該客戶及美甲師的事件。
+    """
+    if not calendar_available():
         logger.error("Google Calendar API 不可用，無法刪除事件")
         return False
     
     try:
-        start_time = f"{date_str}T{time_str}:00+08:00"
-        end_time = datetime.fromisoformat(f"{date_str}T{time_str}:00")
-        end_time = end_time + timedelta(minutes=30)
-        end_time = end_time.isoformat() + "+08:00"
+        duration = duration or get_catalog().default_duration
+        start = datetime.fromisoformat(f"{date_str}T{time_str}:00+08:00")
+        start_time = start.isoformat()
+        end_time = (start + timedelta(minutes=duration)).isoformat()
         
-        calendar_id = os.environ.get('GOOGLE_CALENDAR_ID', 'primary')
+        calendar_id = get_calendar_id(manicurist_id, 'primary')
         
-        events_result = calendar_service.events().list(
+        events_result = execute_calendar_request(lambda service: service.events().list(
             calendarId=calendar_id,
             timeMin=start_time,
             timeMax=end_time,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
+        ))
         
         events = events_result.get('items', [])
         deleted_count = 0
         
         for event in events:
+            # 只刪除在預約時間開始的事件，不影響與其重疊的其他預約
+            event_start = event['start'].get('dateTime')
+            if not event_start or dateutil.parser.isoparse(event_start) != start:
+                continue
+            if not is_booking_event(event, user_id, manicurist_id):
+                continue
             event_id = event['id']
-            calendar_service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+            execute_calendar_request(
+                lambda service, event_id=event_id: service.events().delete(calendarId=calendar_id, eventId=event_id)
+            )
             logger.info(f"已從Google日曆刪除事件: ID={event_id}, 標題={event.get('summary')}")
             deleted_count += 1
         
         return deleted_count > 0
+    except CircuitOpenError:
+        queue_calendar_write(delete_event_from_calendar, date_str, time_str, manicurist_id, duration, user_id)
+        return True
     except Exception as e:
         logger.error(f"刪除Google日曆事件失敗: {str(e)}")
         return False
 
+# 管理API：以 Authorization: Bearer <ADMIN_TOKEN> 驗證（多店家時可用 ADMIN_TOKEN_<店家ID> 分別設定）
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+ADMIN_BATCH_SIZE = 50  # 每個行事曆批次請求最多包含的事件數
+EXPORT_PAGE_SIZE = 250
+EXPORT_FIELDS = [
+    'type', 'date', 'time', 'end_time', 'manicurist_id', 'manicurist_name', 'service',
+    'customer_id', 'customer_name', 'resources', 'summary', 'event_id'
+]
+
+def get_admin_tenant(tenant_id):
+    """驗證管理API的權杖後回傳店家，未設定權杖時不開放"""
+    tenant_id = tenant_id or DEFAULT_TENANT
+    if tenant_id not in tenant_registry.configs:
+        abort(404)
+    token = tenant_env(tenant_id, 'ADMIN_TOKEN', os.environ.get('ADMIN_TOKEN'))
+    provided = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(provided.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+        logger.warning(f"管理API驗證失敗: 店家 {tenant_id}, 路徑: {request.path}")
+        abort(401)
+    return tenant_registry.get(tenant_id)
+
+def parse_date_arg(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        abort(400, description=f"{name} 必須是 YYYY-MM-DD 格式")
+
+def event_start(event):
+    """事件的開始時間（全天事件視為當天0點）"""
+    start = event['start']
+    if 'dateTime' in start:
+        return dateutil.parser.isoparse(start['dateTime'])
+    return datetime.fromisoformat(f"{start['date']}T00:00:00+08:00")
+
+def iter_calendar_events(calendar_id, time_min, time_max):
+    """逐頁讀取行事曆事件，記憶體中一次只保留一頁"""
+    page_token = None
+    while True:
+        result = execute_calendar_request(lambda service, token=page_token: service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            singleEvents=True,
+            orderBy='startTime',
+            maxResults=EXPORT_PAGE_SIZE,
+            pageToken=token
+        ))
+        yield from result.get('items', [])
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+def event_to_export_row(event, manicurists):
+    """把行事曆事件轉成匯出的一列，舊的事件沒有 extendedProperties 時從描述中解析"""
+    private = event.get('extendedProperties', {}).get('private', {})
+    described = {}
+    for line in event.get('description', '').split('\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            described[key.strip()] = value.strip()
+    
+    manicurist_id = private.get('manicurist_id') or described.get('美甲師', '').rpartition('(ID: ')[2].rstrip(')')
+    customer_id = private.get('user_id') or described.get('客戶 ID', '')
+    if private.get('kind') == 'block':
+        row_type = 'block'
+    elif private.get('kind') == 'booking' or customer_id:
+        row_type = 'booking'
+    else:
+        row_type = 'event'
+    
+    start = event_start(event).astimezone(TAIPEI_TZ)
+    end_value = event.get('end', {})
+    end = dateutil.parser.isoparse(end_value['dateTime']).astimezone(TAIPEI_TZ) if 'dateTime' in end_value else None
+    return {
+        'type': row_type,
+        'date': start.strftime('%Y-%m-%d'),
+        'time': start.strftime('%H:%M'),
+        'end_time': end.strftime('%H:%M') if end else '',
+        'manicurist_id': manicurist_id,
+        'manicurist_name': manicurists.get(manicurist_id, {}).get('name', ''),
+        'service': private.get('service') or described.get('服務', ''),
+        'customer_id': customer_id,
+        'customer_name': described.get('客戶名稱', ''),
+        'resources': private.get('resources', ''),
+        'summary': event.get('summary', ''),
+        'event_id': event.get('id', '')
+    }
+
+def iter_export_rows(start_date, end_date):
+    """依開始時間排序產生日期範圍內（含首尾）所有行事曆事件的匯出資料
+    
+    每個行事曆各自分頁讀取並已依開始時間排序，以 heapq.merge 逐筆合併，
+    不論範圍多大，記憶體中只保留每個行事曆的一頁。
+    """
+    manicurists = get_catalog().manicurists
+    time_min = f"{start_date}T00:00:00+08:00"
+    time_max = (datetime.fromisoformat(f"{end_date}T00:00:00+08:00") + timedelta(days=1)).isoformat()
+    # 多位美甲師共用同一個行事曆時只讀取一次
+    calendar_ids = sorted({get_calendar_id(manicurist_id, 'primary') for manicurist_id in manicurists})
+    streams = [iter_calendar_events(calendar_id, time_min, time_max) for calendar_id in calendar_ids]
+    for event in heapq.merge(*streams, key=event_start):
+        yield event_to_export_row(event, manicurists)
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+@admin_bp.route("/bookings", methods=['GET'])
+@admin_bp.route("/<tenant_id>/bookings", methods=['GET'])
+def export_bookings(tenant_id=None):
+    """串流匯出日期範圍內的預約，?start=YYYY-MM-DD&end=YYYY-MM-DD&format=csv|ndjson"""
+    tenant = get_admin_tenant(tenant_id)
+    start_date = parse_date_arg(request.args.get('start'), 'start')
+    end_date = parse_date_arg(request.args.get('end', start_date), 'end')
+    output_format = request.args.get('format', 'csv')
+    if output_format not in ('csv', 'ndjson'):
+        abort(400, description="format 必須是 csv 或 ndjson")
+    with tenant_scope(tenant):
+        if not calendar_available():
+            return "Google Calendar API 不可用", 503
+    
+    def generate():
+        with tenant_scope(tenant):
+            try:
+                rows = iter_export_rows(start_date, end_date)
+                if output_format == 'csv':
+                    yield from iter_csv(rows)
+                else:
+                    for row in rows:
+                        yield json.dumps(row, ensure_ascii=False) + "\n"
+            except Exception as e:
+                # 回應已開始傳送，無法再改變狀態碼
+                logger.error(f"匯出 {start_date} ~ {end_date} 的預約時中斷: {str(e)}")
+                if output_format == 'ndjson':
+                    yield json.dumps({'error': str(e)}, ensure_ascii=False) + "\n"
+    
+    logger.info(f"店家 {tenant.tenant_id} 匯出 {start_date} ~ {end_date} 的預約 ({output_format})")
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=bookings-{start_date}-{end_date}.{output_format}'
+    })
+
+def iter_import_rows(stream, is_csv):
+    """逐列讀取上傳的 CSV 或 NDJSON，產生 (列號, 資料或解析錯誤)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if is_csv else None)
+    if is_csv:
+        # 列號從資料的第一列（標題的下一列）開始計算
+        for row_number, row in enumerate(csv.DictReader(text), 1):
+            yield row_number, row
+        return
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("每列必須是JSON物件")
+            yield row_number, row
+        except ValueError as e:
+            yield row_number, e
+
+def build_block_event(date_str, time_str, end_time_str, manicurist_id, reason):
+    """建立休息、休假等不開放預約時段的日曆事件"""
+    manicurist_name = get_catalog().manicurists.get(manicurist_id, {}).get('name', '')
+    return {
+        'summary': f"{reason} - {manicurist_name}",
+        'description': f"美甲師: {manicurist_name} (ID: {manicurist_id})",
+        'start': {'dateTime': f"{date_str}T{time_str}:00+08:00", 'timeZone': 'Asia/Taipei'},
+        'end': {'dateTime': f"{date_str}T{end_time_str}:00+08:00", 'timeZone': 'Asia/Taipei'},
+        'transparency': 'opaque',
+        'extendedProperties': {
+            'private': {'kind': 'block', 'manicurist_id': str(manicurist_id)},
+        },
+    }
+
+def apply_import_row(row):
+    """驗證一列匯入資料並套用到本地紀錄
+    
+    Returns:
+        dict: 要寫入行事曆的內容，寫入失敗時以 rollback() 撤銷本地的變更
+    Raises:
+        ValueError: 資料不正確或時段已被佔用時
+    """
+    tenant = current_tenant()
+    catalog = get_catalog()
+    row_type = (row.get('type') or 'booking').strip()
+    date_str = str(row.get('date', '')).strip()
+    time_str = str(row.get('time', '')).strip()
+    manicurist_id = str(row.get('manicurist_id', '')).strip()
+    try:
+        start_at = datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M')
+    except ValueError:
+        raise ValueError("date/time 必須是 YYYY-MM-DD 及 HH:MM 格式")
+    # 統一成兩位數的格式（例如 9:00 -> 09:00），作為本地紀錄的鍵及行事曆事件的時間
+    date_str, time_str = start_at.strftime('%Y-%m-%d'), start_at.strftime('%H:%M')
+    if manicurist_id not in catalog.manicurists:
+        raise ValueError(f"未知的美甲師: {manicurist_id}")
+    start = parse_minute(time_str)
+    
+    if row_type == 'booking':
+        service = str(row.get('service') or '').strip()
+        if not service:
+            raise ValueError("預約必須指定 service")
+        service_spec = catalog.service(service)
+        try:
+            duration = int(row.get('duration') or service_spec.duration)
+        except ValueError:
+            raise ValueError("duration 必須是分鐘數")
+        if duration <= 0:
+            raise ValueError("duration 必須大於0")
+        # 匯入資料可指定與服務目錄不同的時間，資源需求仍依服務目錄
+        service_spec = Service(service, duration, service_spec.resources)
+        user_id = str(row.get('customer_id') or '').strip() or None
+    elif row_type == 'block':
+        try:
+            end_time_str = datetime.strptime(str(row.get('end_time', '')).strip(), '%H:%M').strftime('%H:%M')
+        except ValueError:
+            raise ValueError("休息時段必須指定 end_time (HH:MM)")
+        duration = parse_minute(end_time_str) - start
+        if duration <= 0:
+            raise ValueError("end_time 必須晚於 time")
+        user_id = service = None
+    else:
+        raise ValueError(f"未知的類型: {row_type}（booking 或 block）")
+    
+    try:
+        availability = get_cached_availability(date_str)
+    except Exception as e:
+        raise ValueError(f"無法查詢行事曆: {e}")
+    entry = availability.get(manicurist_id)
+    if entry is None or entry['error']:
+        raise ValueError(f"無法查詢美甲師的行事曆: {entry['error'] if entry else manicurist_id}")
+    
+    slot_key = f"{date_str} {time_str}"
+    local_calendar = tenant.manicurist_calendars[manicurist_id]
+    with tenant.booking_lock:
+        if slot_key in local_calendar:
+            raise ValueError("此時段已有預約")
+        if user_id and get_existing_booking(user_id) is not None:
+            raise ValueError(f"客戶 {user_id} 已有預約")
+        # 與 reserve_slot 相同，依行事曆、本地預約及候補保留時段建立排程確認美甲師及資源都有空
+        schedule = build_day_schedule(date_str, availability, user_id)
+        if service:
+            assignment = schedule.can_start(service_spec, start, manicurist_id)
+            if assignment is None:
+                raise ValueError("此時段美甲師或所需資源已被預約")
+            resources = assignment['resources']
+        else:
+            if not schedule.stylists[manicurist_id].is_free(start, start + duration):
+                raise ValueError("休息時段與既有預約重疊")
+            resources = []
+        local_calendar[slot_key] = {'user_id': user_id, 'service': service, 'duration': duration, 'resources': resources}
+        if service:
+            booking_data = {
+                'category': '美甲服務',
+                'service': service,
+                'date': date_str,
+                'time': time_str,
+                'duration': duration,
+                'resources': resources,
+                'manicurist_id': manicurist_id,
+                'manicurist_name': catalog.manicurists[manicurist_id]['name']
+            }
+            if user_id:
+                tenant.bookings[user_id] = booking_data
+    invalidate_availability(date_str)
+    
+    if service:
+        event = build_booking_event(user_id, booking_data, str(row.get('customer_name') or '未知'))
+    else:
+        event = build_block_event(date_str, time_str, end_time_str, manicurist_id, str(row.get('reason') or '休息'))
+    
+    def rollback():
+        with tenant.booking_lock:
+            local_calendar.pop(slot_key, None)
+            if user_id and tenant.bookings.get(user_id) is booking_data:
+                del tenant.bookings[user_id]
+        invalidate_availability(date_str)
+    
+    def commit():
+        # 匯入的預約計入統計（休息時段不計），預約的前置時間未知
+        if service:
+            tenant.stats.record_booking(date_str, time_str, manicurist_id, service, duration)
+    
+    return {
+        'calendar_id': get_calendar_id(manicurist_id, 'primary'),
+        'event': event,
+        'rollback': rollback,
+        'commit': commit
+    }
+
+def insert_calendar_event(calendar_id, event):
+    """寫入一筆日曆事件，斷路器開啟時排入延後寫入的佇列"""
+    try:
+        execute_calendar_request(lambda service: service.events().insert(calendarId=calendar_id, body=event))
+    except CircuitOpenError:
+        queue_calendar_write(insert_calendar_event, calendar_id, event)
+
+def write_import_batch(batch):
+    """以一個批次請求把最多 ADMIN_BATCH_SIZE 筆事件寫入行事曆，產生每列的結果"""
+    responses = {}
+    
+    def on_response(request_id, response, exception):
+        responses[request_id] = (response, exception)
+    
+    def make_batch(service):
+        batch_request = service.new_batch_http_request(callback=on_response)
+        for row_number, item in batch:
+            batch_request.add(
+                service.events().insert(calendarId=item['calendar_id'], body=item['event']),
+                request_id=str(row_number)
+            )
+        return batch_request
+    
+    try:
+        execute_calendar_request(make_batch)
+    except CircuitOpenError:
+        for row_number, item in batch:
+            queue_calendar_write(insert_calendar_event, item['calendar_id'], item['event'])
+            item['commit']()
+            yield {'row': row_number, 'status': 'queued'}
+        return
+    except Exception as e:
+        logger.error(f"批次寫入 {len(batch)} 筆日曆事件失敗: {str(e)}")
+        for row_number, item in batch:
+            item['rollback']()
+            yield {'row': row_number, 'status': 'error', 'error': f"寫入行事曆失敗: {str(e)}"}
+        return
+    
+    for row_number, item in batch:
+        response, exception = responses.get(str(row_number), (None, None))
+        if exception is not None or response is None:
+            item['rollback']()
+            yield {'row': row_number, 'status': 'error', 'error': f"寫入行事曆失敗: {exception}"}
+        else:
+            item['commit']()
+            yield {'row': row_number, 'status': 'ok', 'event_id': response.get('id')}
+
+def apply_import(rows):
+    """逐列套用匯入資料，每 ADMIN_BATCH_SIZE 列以一個批次請求寫入行事曆，產生每列的結果"""
+    batch = []
+    for row_number, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise ValueError(f"無法解析: {str(row)}")
+            batch.append((row_number, apply_import_row(row)))
+        except (ValueError, TypeError) as e:
+            yield {'row': row_number, 'status': 'error', 'error': str(e)}
+            continue
+        if len(batch) >= ADMIN_BATCH_SIZE:
+            yield from write_import_batch(batch)
+            batch = []
+    if batch:
+        yield from write_import_batch(batch)
+
+@admin_bp.route("/import", methods=['POST'])
+@admin_bp.route("/<tenant_id>/import", methods=['POST'])
+def import_bookings(tenant_id=None):
+    """批次匯入預約（type=booking）或休息時段（type=block），上傳 CSV（text/csv）或 NDJSON，以 NDJSON 串流回傳每列結果"""
+    tenant = get_admin_tenant(tenant_id)
+    with tenant_scope(tenant):
+        if not calendar_available():
+            return "Google Calendar API 不可用", 503
+    is_csv = request.mimetype == 'text/csv'
+    
+    def generate():
+        counts = defaultdict(int)
+        with tenant_scope(tenant):
+            for result in apply_import(iter_import_rows(request.stream, is_csv)):
+                counts[result['status']] += 1
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        logger.info(f"店家 {tenant.tenant_id} 匯入完成: {dict(counts)}")
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@admin_bp.route("/no-show", methods=['POST'])
+@admin_bp.route("/<tenant_id>/no-show", methods=['POST'])
+def record_no_show(tenant_id=None):
+    """記錄客戶未到，JSON 內容 {"date": "YYYY-MM-DD", "time": "HH:MM", "manicurist_id": "1"}"""
+    tenant = get_admin_tenant(tenant_id)
+    data = request.get_json(silent=True) or {}
+    date_str = parse_date_arg(data.get('date'), 'date')
+    slot_key = f"{date_str} {data.get('time')}"
+    with tenant.booking_lock:
+        entry = tenant.manicurist_calendars.get(str(data.get('manicurist_id')), {}).get(slot_key)
+        if entry is None or not entry.get('service'):
+            abort(404, description="找不到此預約")
+        # 同一筆預約只計一次
+        first_report = not entry.get('no_show')
+        entry['no_show'] = True
+    if first_report:
+        tenant.stats.record_no_show(date_str)
+        logger.info(f"店家 {tenant.tenant_id} 記錄未到: 美甲師 {data.get('manicurist_id')}, {slot_key}")
+    return json.dumps({'status': 'ok', 'recorded': first_report}), 200, {'Content-Type': 'application/json'}
+
+@admin_bp.route("/stats", methods=['GET'])
+@admin_bp.route("/<tenant_id>/stats", methods=['GET'])
+def booking_stats(tenant_id=None):
+    """預約統計，?start=YYYY-MM-DD&end=YYYY-MM-DD（默認為到今天為止的30天）
+    
+    由預約、取消及未到時累加的計數器彙總，不查詢行事曆。
+    """
+    tenant = get_admin_tenant(tenant_id)
+    today = datetime.now(TAIPEI_TZ).strftime('%Y-%m-%d')
+    end_date = parse_date_arg(request.args.get('end', today), 'end')
+    default_start = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=29)).strftime('%Y-%m-%d')
+    start_date = parse_date_arg(request.args.get('start', default_start), 'start')
+    if start_date > end_date:
+        abort(400, description="start 不可晚於 end")
+    
+    catalog = tenant.catalog_store.get()
+    business_hours = catalog.business_hours
+    report = tenant.stats.report(
+        start_date, end_date, business_hours['start'] * 60, business_hours['end'] * 60
+    )
+    for manicurist_id, stylist in report['stylists'].items():
+        stylist['name'] = catalog.manicurists.get(manicurist_id, {}).get('name', '')
+    return json.dumps(report, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
 # 處理好友加入事件
-@handler.add(FollowEvent)
+@on_event('follow')
 def handle_follow(event):
     try:
-        user_id = event.source.user_id
+        user_id = event.user_id
         logger.info(f"新用戶加入: {user_id}")
         
-        # 發送歡迎訊息和服務選項
-        welcome_message = (
-            "👋 歡迎加入美甲預約系統！\n\n"
-            "我們提供以下服務：\n"
-            "💅 預約 - 立即預約美甲服務\n"
-            "🔍 查詢預約 - 查看您的預約資訊\n"
-            "❌ 取消預約 - 取消現有預約\n\n"
-            "請點擊下方按鈕選擇您需要的服務！👇👇👇"
-        )
-        
-        # 顯示服務選項
-        carousel_template = CarouselTemplate(
-            columns=[
-                CarouselColumn(
-                    thumbnail_image_url="https://example.com/nail_art1.jpg",
-                    title="基礎美甲服務",
-                    text="選擇您想要的基礎美甲服務",
-                    actions=[
-                        PostbackTemplateAction(
-                            label="基礎凝膠",
-                            data="service_基礎凝膠"
-                        ),
-                        PostbackTemplateAction(
-                            label="基礎保養",
-                            data="service_基礎保養"
-                        ),
-                        PostbackTemplateAction(
-                            label="卸甲服務",
-                            data="service_卸甲服務"
-                        )
-                    ]
-                ),
-                CarouselColumn(
-                    thumbnail_image_url="https://example.com/nail_art2.jpg",
-                    title="進階美甲服務",
-                    text="選擇您想要的進階美甲服務",
-                    actions=[
-                        PostbackTemplateAction(
-                            label="法式凝膠",
-                            data="service_法式凝膠"
-                        ),
-                        PostbackTemplateAction(
-                            label="漸層凝膠",
-                            data="service_漸層凝膠"
-                        ),
-                        PostbackTemplateAction(
-                            label="鑽飾設計",
-                            data="service_鑽飾設計"
-                        )
-                    ]
-                )
-            ]
-        )
-        
-        template_message = TemplateSendMessage(
-            alt_text='美甲服務選擇',
-            template=carousel_template
-        )
+        catalog = get_catalog()
         
         # 先發送歡迎訊息
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=welcome_message)
-        )
+        reply_to(event, catalog.message('welcome'))
         
         # 然後發送服務選項
-        line_bot_api.push_message(
-            user_id,
-            template_message
-        )
+        event.tenant.line_bot_api.push_message(user_id, catalog.message('service_carousel'), timeout=budget(LINE_API_TIMEOUT))
         
     except Exception as e:
         logger.error(f"處理好友加入事件時發生錯誤: {str(e)}")
 
-if __name__ == "__main__":
-    logger.info("美甲預約機器人開始啟動...")
-    
+def load_env_file():
+    """載入 .env 檔案中的環境變數，未安裝 python-dotenv 或沒有檔案時回傳False"""
     try:
-        # 載入 .env 檔案中的環境變數
+        from dotenv import load_dotenv
+    except ImportError:
+        return False
+    try:
+        return load_dotenv()
+    except Exception as e:
+        logger.warning(f"載入 .env 檔案失敗: {str(e)}")
+        return False
+
+def init_worker_state():
+    """建立每個工作程序自己的日誌背景執行緒、執行緒池及連線（各店家的斷路器及快取由 Tenant.reset_worker_state 重建）
+    
+    fork 只複製呼叫 fork 的執行緒：父程序的執行緒池及日誌背景執行緒在子程序中都不存在，
+    其他執行緒持有的鎖也不會被釋放，因此這些狀態在 create_app 時建立，並在每次 fork 後於子程序重新建立。
+    服務目錄、憑證等建立後不再變動的狀態不受影響，繼續與父程序共用。
+    """
+    global profile_executor, task_executor, calendar_executor, _calendar_local
+    configure_logging()
+    profile_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='profile')
+    task_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get('TASK_MAX_WORKERS', 8)),
+        thread_name_prefix='task'
+    )
+    calendar_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get('CALENDAR_MAX_WORKERS', 8)),
+        thread_name_prefix='calendar'
+    )
+    _calendar_local = threading.local()
+    if tenant_registry is not None:
+        for tenant in tenant_registry.reset_worker_state():
+            tenant.profile_cache.reset_worker_state(profile_executor)
+
+def preload_tenant_ids():
+    """PRELOAD_TENANTS 指定要預先載入的店家：未設置或 0 時不預先載入（收到請求時才載入），
+    all 時載入設定中的前 TENANT_MAX_ACTIVE 間，其他值為以逗號分隔的店家ID"""
+    value = os.environ.get('PRELOAD_TENANTS', '0').strip()
+    if value in ('', '0'):
+        return []
+    if value == 'all':
+        return tenant_registry.tenant_ids()[:tenant_registry.max_active]
+    return [tenant_id.strip() for tenant_id in value.split(',') if tenant_id.strip()]
+
+def preload_tenants(tenant_ids):
+    """預先建立店家狀態，fork 前建立時各工作程序共用已載入的服務目錄"""
+    for tenant_id in tenant_ids[:tenant_registry.max_active]:
         try:
-            from dotenv import load_dotenv
-            load_dotenv()
-            logger.info("已載入 .env 檔案中的環境變數")
+            tenant_registry.get(tenant_id)
         except Exception as e:
-            logger.warning(f"載入 .env 檔案失敗: {str(e)}")
-        
-        google_credentials_json = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
-        google_credentials_file = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-        google_calendar_id = os.environ.get('GOOGLE_CALENDAR_ID')
-        
-        if google_credentials_json and google_calendar_id:
-            logger.info("Google行事曆集成已設置(JSON方式)")
-            logger.info(f"使用憑證JSON環境變量 (長度: {len(google_credentials_json)} 字符)")
-            logger.info(f"使用行事曆ID: {google_calendar_id}")
-        elif google_credentials_file and google_calendar_id:
-            logger.info("Google行事曆集成已設置(文件方式)")
-            logger.info(f"使用憑證文件: {google_credentials_file}")
-            logger.info(f"使用行事曆ID: {google_calendar_id}")
-        else:
-            logger.warning("未設置Google行事曆環境變量")
-            if not google_calendar_id:
-                logger.warning("缺少 GOOGLE_CALENDAR_ID 環境變量")
-            if not (google_credentials_json or google_credentials_file):
-                logger.warning("缺少 GOOGLE_APPLICATION_CREDENTIALS_JSON 或 GOOGLE_APPLICATION_CREDENTIALS 環境變量")
-        
-        channel_secret_value = os.environ.get('LINE_CHANNEL_SECRET')
-        channel_access_token_value = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
-        
-        if not channel_secret_value:
-            logger.warning("警告: 未設定 LINE_CHANNEL_SECRET 環境變量")
-            channel_secret_value = '3d4224a4cb32b140610545e6d155cc0d'
-        
-        if not channel_access_token_value:
-            logger.warning("警告: 未設定 LINE_CHANNEL_ACCESS_TOKEN 環境變量")
-            channel_access_token_value = 'YCffcEj/7aUw33XPEtfVMuKf1l5i5ztIHLibGTy2zGuyNgLf1RXJCqA8dVhbMp8Yxbwsr1CP6EfJID8htKS/Q3io/WSfp/gtDcaRfDT/TNErwymfiIdGWdLROcBkTfRN7hXFqHVrDQ+WgkkMGFWc3AdB04t89/1O/w1cDnyilFU='
+            logger.error(f"預先載入店家 {tenant_id} 失敗，收到該店的請求時再重試: {str(e)}")
+
+_fork_handler_registered = False
+
+def create_app():
+    """建立 Flask 應用程式
+    
+    設定、憑證及各店家的服務目錄等不變的狀態只在這裡建立一次。以 gunicorn --preload
+    （見 gunicorn.conf.py）啟動時在 fork 前建立，各工作程序以 copy-on-write 共用；
+    執行緒池、鎖及連線等每個工作程序自己的狀態由 init_worker_state 在 fork 後重新建立。
+    """
+    global google_credentials, GOOGLE_CALENDAR_AVAILABLE, tenant_registry, _fork_handler_registered
+    env_loaded = load_env_file()
+    init_worker_state()
+    logger.info("美甲預約機器人開始啟動...")
+    if env_loaded:
+        logger.info("已載入 .env 檔案中的環境變數")
+    
+    google_credentials = load_google_credentials()
+    GOOGLE_CALENDAR_AVAILABLE = google_credentials is not None
+    
+    tenant_configs = load_tenant_configs()
+    logger.info(f"已設定 {len(tenant_configs)} 間店家: {', '.join(tenant_configs)}")
+    tenant_registry = TenantRegistry(
+        tenant_configs,
+        build_tenant,
+        max_active=int(os.environ.get('TENANT_MAX_ACTIVE', 32)),
+        idle_seconds=float(os.environ.get('TENANT_IDLE_SECONDS', 1800))
+    )
+    preload_tenants(preload_tenant_ids())
+    
+    if not _fork_handler_registered:
+        os.register_at_fork(after_in_child=init_worker_state)
+        _fork_handler_registered = True
+    
+    flask_app = Flask(__name__)
+    flask_app.register_error_handler(404, handle_404)
+    flask_app.register_error_handler(Exception, handle_exception)
+    flask_app.register_blueprint(bot_bp)
+    flask_app.register_blueprint(admin_bp)
+    return flask_app
+
+# gunicorn app:app 及 python app.py 都使用此應用程式
+app = create_app()
+
+if __name__ == "__main__":
+    try:
+        # 本地開發時未設定 LINE 憑證則使用測試用的機器人（單一店家模式）
+        default_settings = tenant_registry.configs.get(DEFAULT_TENANT)
+        if default_settings is not None:
+            channel_secret_value = os.environ.get('LINE_CHANNEL_SECRET')
+            channel_access_token_value = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
+            if not channel_secret_value:
+                logger.warning("警告: 未設定 LINE_CHANNEL_SECRET 環境變量")
+                default_settings['channel_secret'] = '3d4224a4cb32b140610545e6d155cc0d'
+            if not channel_access_token_value:
+                logger.warning("警告: 未設定 LINE_CHANNEL_ACCESS_TOKEN 環境變量")
+                default_settings['channel_access_token'] = 'YCffcEj/7aUw33XPEtfVMuKf1l5i5ztIHLibGTy2zGuyNgLf1RXJCqA8dVhbMp8Yxbwsr1CP6EfJID8htKS/Q3io/WSfp/gtDcaRfDT/TNErwymfiIdGWdLROcBkTfRN7hXFqHVrDQ+WgkkMGFWc3AdB04t89/1O/w1cDnyilFU='
+            if not (channel_secret_value and channel_access_token_value):
+                tenant_registry.evict(DEFAULT_TENANT)
         
-        line_bot_api = LineBotApi(channel_access_token_value)
-        handler = WebhookHandler(channel_secret_value)
+        if not os.environ.get('GOOGLE_CALENDAR_ID'):
+            logger.warning("缺少 GOOGLE_CALENDAR_ID 環境變量")
         
-        try:
-            bot_info = line_bot_api.get_bot_info()
-            logger.info(f"機器人成功連接: {bot_info.display_name} (ID: {bot_info.user_id})")
-        except LineBotApiError as e:
-            logger.error(f"機器人配置錯誤: {str(e)}")
-            logger.warning("請檢查您的 Channel Secret 和 Access Token 是否正確")
+        for tenant_id in tenant_registry.tenant_ids():
+            try:
+                bot_info = tenant_registry.get(tenant_id).line_bot_api.get_bot_info()
+                logger.info(f"店家 {tenant_id} 的機器人成功連接: {bot_info.display_name} (ID: {bot_info.user_id})")
+            except Exception as e:
+                logger.error(f"店家 {tenant_id} 的機器人配置錯誤: {str(e)}")
+                logger.warning("請檢查您的 Channel Secret 和 Access Token 是否正確")
         
         if GOOGLE_CALENDAR_AVAILABLE:
             logger.info("Google日曆API已成功初始化並可用")
@@ -0,0 +1,104 @@
+"""比較每個 webhook 請求在請求執行緒上花在日誌的時間
+
+    python benchmarks/bench_logging.py [請求數]
+
+舊設定：logging.basicConfig 同步寫出，/callback 以 f-string 在 INFO 記錄完整 headers 及 body 前100字
+新設定：log_setup.configure_logging（佇列 + 背景執行緒、JSON、延後格式化、headers/body 降為 DEBUG、
+        健康檢查及 webhook 取樣）
+
+兩者都寫入暫存檔，量測的是呼叫端（請求執行緒）的 CPU 時間；
+新設定另外量測背景執行緒把佇列寫完所需的總時間。
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_setup import configure_logging, stop_logging
+
+HEADERS = {
+    'Host': 'line-nail-bot.onrender.com',
+    'User-Agent': 'LineBotWebhook/2.0',
+    'Content-Length': '512',
+    'Content-Type': 'application/json; charset=utf-8',
+    'X-Line-Signature': 'rb/JRBI3xhvMgAANEW56q4gPFgEXn5uDPxhbN0/ExNw=',
+    'X-Forwarded-For': '147.92.150.192',
+}
+BODY = '{"destination":"U0123","events":[{"type":"message","message":{"type":"text","text":"預約"}}]}' * 4
+
+
+def legacy_request(logger):
+    """舊版 /callback 及健康檢查的日誌呼叫"""
+    logger.info("收到健康檢查請求")
+    logger.info(f"收到 /callback 請求，方法: POST, 路徑: /callback, 頭部: {HEADERS}")
+    logger.info(f"收到webhook請求: {BODY[:100]}...")
+    logger.info(f"收到來自用戶 {'U' * 33} 的文字消息: {'預約'}")
+
+
+def new_request(logger, health_logger, webhook_logger):
+    """新版的日誌呼叫"""
+    health_logger.info("收到健康檢查請求")
+    webhook_logger.debug("收到 /callback 請求，方法: %s, 路徑: %s, 頭部: %s", 'POST', '/callback', HEADERS)
+    webhook_logger.info("收到webhook請求: %d 個事件, %d bytes", 1, len(BODY))
+    logger.info("收到來自用戶 %s 的文字消息: %s", 'U' * 33, '預約')
+
+
+def run_legacy(path, requests_count):
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    stream = open(path, 'w', encoding='utf-8')
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    logger = logging.getLogger('app')
+
+    start = time.thread_time()
+    for _ in range(requests_count):
+        legacy_request(logger)
+    elapsed = time.thread_time() - start
+    root.removeHandler(handler)
+    stream.close()
+    return elapsed
+
+
+def run_new(path, requests_count):
+    stream = open(path, 'w', encoding='utf-8')
+    configure_logging(level='INFO', levels={}, sample_rates={'app.health': 0.01, 'app.webhook': 0.1},
+                      fmt='json', stream=stream)
+    logger = logging.getLogger('app')
+    health_logger = logging.getLogger('app.health')
+    webhook_logger = logging.getLogger('app.webhook')
+
+    wall_start = time.perf_counter()
+    # 格式化及寫出都在背景執行緒，因此以 thread_time 只量測請求執行緒
+    start = time.thread_time()
+    for _ in range(requests_count):
+        new_request(logger, health_logger, webhook_logger)
+    elapsed = time.thread_time() - start
+    stop_logging()
+    drained = time.perf_counter() - wall_start
+    stream.close()
+    return elapsed, drained
+
+
+def main(requests_count):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.log')
+        new_path = os.path.join(tmp, 'new.log')
+        legacy = run_legacy(legacy_path, requests_count)
+        new, drained = run_new(new_path, requests_count)
+
+        print(f"請求數: {requests_count}")
+        print(f"舊設定 請求執行緒 µs/請求: {legacy / requests_count * 1e6:8.2f}")
+        print(f"新設定 請求執行緒 µs/請求: {new / requests_count * 1e6:8.2f}")
+        print(f"新設定 寫完佇列總時間:     {drained:8.3f} 秒")
+        print(f"日誌大小: 舊 {os.path.getsize(legacy_path)} bytes / 新 {os.path.getsize(new_path)} bytes")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,113 @@
+"""比較 gunicorn 有無 --preload 時的啟動時間及每個工作程序的記憶體
+
+    python benchmarks/bench_startup.py [工作程序數 ...]
+
+不預載：每個工作程序各自 import app（載入憑證、服務目錄等）
+預載：使用 gunicorn.conf.py，主程序執行 create_app 後才 fork，工作程序共用已載入的狀態
+（兩種模式都以 PRELOAD_TENANTS=all 在 create_app 時載入店家）
+
+量測項目：
+- 首次回應：從啟動 gunicorn 到健康檢查第一次成功回應的時間
+- 全部就緒：到所有工作程序都已啟動的時間
+- 每個工作程序的 RSS、PSS（共用分頁依共用的程序數平分）及私有記憶體，讀取 /proc/<pid>/smaps_rollup（僅限 Linux）
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_kb(pid):
+    """回傳 (RSS, PSS, 私有) KB"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if rest.strip().endswith('kB'):
+                values[name] = int(rest.split()[0])
+    return values['Rss'], values['Pss'], values['Private_Clean'] + values['Private_Dirty']
+
+
+def ping(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def run(workers, config_path):
+    port = free_port()
+    env = dict(
+        os.environ,
+        LINE_CHANNEL_SECRET=os.environ.get('LINE_CHANNEL_SECRET', 'benchmark-channel-secret'),
+        LINE_CHANNEL_ACCESS_TOKEN=os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', 'benchmark-access-token'),
+        LOG_LEVEL='WARNING',
+        PRELOAD_TENANTS=os.environ.get('PRELOAD_TENANTS', 'all'),
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '-c', config_path,
+         '-w', str(workers), '-b', f'127.0.0.1:{port}'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f'http://127.0.0.1:{port}/'
+        first_response = None
+        while time.perf_counter() - start < 60:
+            if first_response is None and ping(url):
+                first_response = time.perf_counter() - start
+            if first_response is not None and len(children(process.pid)) >= workers:
+                break
+            time.sleep(0.01)
+        all_ready = time.perf_counter() - start
+        # 讓每個工作程序都處理幾個請求，量測的是實際服務中的記憶體
+        for _ in range(workers * 5):
+            ping(url)
+        memory = [memory_kb(pid) for pid in children(process.pid)]
+        return first_response, all_ready, memory
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(worker_counts):
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as f:
+        f.write('preload_app = False\n')
+        no_preload_config = f.name
+    configs = [('不預載', no_preload_config), ('預載', os.path.join(ROOT, 'gunicorn.conf.py'))]
+    try:
+        print(f"{'模式':<6} {'工作程序':>6} {'首次回應(秒)':>12} {'全部就緒(秒)':>12} "
+              f"{'RSS/程序(MB)':>13} {'PSS/程序(MB)':>13} {'私有/程序(MB)':>14}")
+        for workers in worker_counts:
+            for name, config_path in configs:
+                first_response, all_ready, memory = run(workers, config_path)
+                count = max(1, len(memory))
+                rss, pss, private = (sum(values) / count / 1024 for values in zip(*memory)) if memory else (0, 0, 0)
+                first = f"{first_response:12.3f}" if first_response is not None else f"{'逾時':>12}"
+                print(f"{name:<6} {workers:>8} {first} {all_ready:14.3f} {rss:15.1f} {pss:15.1f} {private:16.1f}")
+    finally:
+        os.unlink(no_preload_config)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1, 2, 4])
@@ -0,0 +1,105 @@
+"""比較 webhook 解析的每事件CPU成本
+
+    python benchmarks/bench_webhook.py [事件數 ...]
+
+SDK 路徑：request.get_data(as_text=True) 解碼 + WebhookHandler.handle（建立完整模型物件並分派）
+快速路徑：webhook.parse_events（以原始位元組驗證簽名、解析一次、建立輕量事件）
+兩者的事件處理函數都不做任何事，只量測解析及分派本身的成本。
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import hashlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot import WebhookHandler
+from linebot.models import MessageEvent, TextMessage, PostbackEvent, FollowEvent
+
+from webhook import parse_events
+
+CHANNEL_SECRET = 'benchmark-channel-secret'
+
+
+def build_payload(event_count):
+    """產生包含文字、Postback及加入好友事件的 webhook 內容"""
+    events = []
+    for i in range(event_count):
+        base = {
+            'replyToken': f'reply-token-{i:032d}',
+            'timestamp': 1700000000000 + i,
+            'mode': 'active',
+            'webhookEventId': f'01H{i:023d}',
+            'deliveryContext': {'isRedelivery': False},
+            'source': {'type': 'user', 'userId': f'U{i:032x}'},
+        }
+        kind = i % 3
+        if kind == 0:
+            base.update(type='message', message={'type': 'text', 'id': str(i), 'text': '預約'})
+        elif kind == 1:
+            base.update(type='postback', postback={
+                'data': 'b|基礎凝膠|2026-10-20|14:30|1|_H0tufUTEZl',
+                'params': {'date': '2026-10-20'}
+            })
+        else:
+            base.update(type='follow')
+        events.append(base)
+    body = json.dumps({'destination': 'Uxxxxxxxx', 'events': events}, ensure_ascii=False).encode('utf-8')
+    signature = base64.b64encode(
+        hmac.new(CHANNEL_SECRET.encode('utf-8'), body, hashlib.sha256).digest()
+    ).decode('utf-8')
+    return body, signature
+
+
+def make_sdk_handler():
+    handler = WebhookHandler(CHANNEL_SECRET)
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def on_text(event):
+        pass
+
+    @handler.add(PostbackEvent)
+    def on_postback(event):
+        pass
+
+    @handler.add(FollowEvent)
+    def on_follow(event):
+        pass
+
+    return handler
+
+
+def measure(func, min_seconds=0.5):
+    """重複執行直到超過 min_seconds，回傳每次呼叫的平均秒數"""
+    iterations = 0
+    start = time.process_time()
+    while True:
+        func()
+        iterations += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_seconds:
+            return elapsed / iterations
+
+
+def main(event_counts):
+    handler = make_sdk_handler()
+    secret = CHANNEL_SECRET.encode('utf-8')
+    noop_handlers = {'message:text': lambda e: None, 'postback': lambda e: None, 'follow': lambda e: None}
+
+    def fast_path(body, signature):
+        for event in parse_events(body, signature, secret):
+            noop_handlers.get(event.kind, lambda e: None)(event)
+
+    print(f"{'事件數':>8} {'SDK µs/事件':>14} {'快速路徑 µs/事件':>18} {'加速':>8}")
+    for count in event_counts:
+        body, signature = build_payload(count)
+        sdk = measure(lambda: handler.handle(body.decode('utf-8'), signature))
+        fast = measure(lambda: fast_path(body, signature))
+        print(f"{count:>8} {sdk / count * 1e6:>14.2f} {fast / count * 1e6:>18.2f} {sdk / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500])
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from linebot.models import (
+    TextSendMessage, TemplateSendMessage, CarouselTemplate,
+    CarouselColumn, PostbackTemplateAction
+)
+
+from scheduling import Service, parse_minute
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedMessage:
+    """已預先轉換好的訊息，可直接傳給 LineBotApi.reply_message / push_message
+
+    SDK 發送時只會呼叫 as_json_dict()，因此這裡直接回傳預先建立好的字典，
+    不再於每次請求時建立及轉換 SDK 模型物件。
+    """
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def as_json_dict(self):
+        return self.payload
+
+
+class Catalog:
+    """服務目錄及訊息模板的不可變快照，載入時一次編譯成可直接發送的訊息"""
+
+    def __init__(self, data, postback_signer):
+        self.manicurists = data['manicurists']
+        self.services = data['services']
+        self.business_hours = data['business_hours']
+        # 排程用：共用資源的數量（例如椅子、UV燈）及各服務所需的時間與資源
+        self.resources = dict(data.get('resources', {}))
+        default_spec = data.get('default_service', {})
+        self.default_duration = int(default_spec.get('duration', 30))
+        self.default_resources = tuple(default_spec.get('resources', ()))
+        self.service_specs = {
+            name: Service(
+                name,
+                spec.get('duration', self.default_duration),
+                spec.get('resources', self.default_resources)
+            ) for name, spec in data.get('service_specs', {}).items()
+        }
+        # 候補的時段區間 [(名稱, 開始分鐘, 結束分鐘), ...]
+        self.waitlist_windows = [
+            (name, parse_minute(start), parse_minute(end))
+            for name, (start, end) in data.get('waitlist_windows', {}).items()
+        ]
+        self.text_templates = dict(data['messages'])
+
+        # 沒有個人化欄位的訊息直接編譯成完整的訊息內容
+        self.prepared = {
+            name: PreparedMessage(TextSendMessage(text=text).as_json_dict())
+            for name, text in self.text_templates.items()
+        }
+        self.prepared['service_carousel'] = PreparedMessage(
+            self._compile_service_carousel(data['service_carousel'], postback_signer)
+        )
+
+    @staticmethod
+    def _compile_service_carousel(config, postback_signer):
+        columns = [
+            CarouselColumn(
+                thumbnail_image_url=column.get('thumbnail_image_url'),
+                title=column['title'],
+                text=column['text'],
+                actions=[
+                    PostbackTemplateAction(label=service, data=postback_signer("s", service))
+                    for service in column['services']
+                ]
+            ) for column in config['columns']
+        ]
+        return TemplateSendMessage(
+            alt_text=config['alt_text'],
+            template=CarouselTemplate(columns=columns)
+        ).as_json_dict()
+
+    def service(self, name):
+        """取得服務的排程需求，目錄中未設定的服務使用默認的時間及資源"""
+        spec = self.service_specs.get(name)
+        if spec is None:
+            spec = Service(name, self.default_duration, self.default_resources)
+        return spec
+
+    def windows_containing(self, minute):
+        """包含指定時間（分鐘）的候補時段區間名稱"""
+        return [name for name, start, end in self.waitlist_windows if start <= minute < end]
+
+    def message(self, name):
+        """取得預先編譯好的訊息"""
+        return self.prepared[name]
+
+    def text(self, name, **fields):
+        """只填入個人化欄位的文字訊息，例如預約確認"""
+        return PreparedMessage({'type': 'text', 'text': self.text_templates[name].format(**fields)})
+
+
+class CatalogStore:
+    """從設定檔載入服務目錄，檔案變更時自動重新載入
+
+    每次 get() 最多每 check_interval 秒檢查一次檔案的修改時間。
+    重新載入時先在背景建立完整的新快照，成功後才以單一賦值替換，
+    因此請求只會看到舊的或新的完整目錄；設定檔有錯誤時保留原本的目錄。
+    """
+
+    def __init__(self, path, postback_signer, check_interval=2.0):
+        self.path = path
+        self.postback_signer = postback_signer
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._file_stamp = None
+        self._next_check = 0.0
+        self._catalog = None
+        if not self.reload():
+            raise RuntimeError(f"無法載入服務目錄: {path}")
+
+    def reset_worker_state(self):
+        """fork 後在子程序中重新建立鎖，已載入的目錄繼續與父程序共用"""
+        self._reload_lock = threading.Lock()
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        """重新載入設定檔，成功返回True"""
+        try:
+            stamp = self._stamp()
+            with open(self.path, encoding='utf-8') as f:
+                catalog = Catalog(json.load(f), self.postback_signer)
+        except Exception as e:
+            logger.error(f"載入服務目錄 {self.path} 失敗，繼續使用目前的目錄: {str(e)}")
+            return False
+        self._catalog = catalog
+        self._file_stamp = stamp
+        logger.info(f"已載入服務目錄: {self.path}")
+        return True
+
+    def get(self):
+        """取得目前的服務目錄"""
+        now = time.monotonic()
+        if now >= self._next_check and self._reload_lock.acquire(blocking=False):
+            # 其他執行緒正在檢查時直接使用目前的目錄，不等待
+            try:
+                self._next_check = now + self.check_interval
+                try:
+                    stamp = self._stamp()
+                except OSError as e:
+                    logger.error(f"無法讀取服務目錄 {self.path}: {str(e)}")
+                    stamp = self._file_stamp
+                if stamp != self._file_stamp:
+                    self.reload()
+                    # 載入失敗時也記下這個版本，避免每次檢查都重複嘗試同一個錯誤的檔案
+                    self._file_stamp = stamp
+            finally:
+                self._reload_lock.release()
+        return self._catalog
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，請求未送出即被拒絕"""
+
+
+class CircuitBreaker:
+    """依滾動時間窗內的錯誤率及慢請求比例開關的斷路器
+
+    - CLOSED：正常放行，記錄每次請求的結果及耗時
+    - OPEN：錯誤率或慢請求比例超過門檻後開啟，open_seconds 內所有請求立即以
+      CircuitOpenError 失敗（只檢查狀態，不等待任何I/O）
+    - HALF_OPEN：開啟時間結束後只放行 half_open_max_calls 個探測請求，
+      成功則關閉，失敗則重新開啟
+    """
+
+    def __init__(self, name, window_seconds=60, min_calls=5, error_rate_threshold=0.5,
+                 slow_call_seconds=3.0, slow_call_rate_threshold=0.5, open_seconds=30,
+                 half_open_max_calls=1, is_failure=None):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure or (lambda exc: True)
+        self.listeners = []  # 狀態改變時呼叫 listener(舊狀態, 新狀態)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_until = 0.0
+        self._half_open_calls = 0
+        # 滾動時間窗：(時間, 是否失敗, 是否為慢請求)，並同步維護計數避免每次重新統計
+        self._window = deque()
+        self._failures = 0
+        self._slow_calls = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_until:
+                return HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """斷路器開啟中（請求會被立即拒絕）時返回True"""
+        return self.state == OPEN
+
+    def _transition(self, new_state):
+        old_state, self._state = self._state, new_state
+        if old_state != new_state:
+            logger.warning(f"斷路器 {self.name} 狀態: {old_state} -> {new_state}")
+        return old_state
+
+    def _notify(self, old_state, new_state):
+        if old_state == new_state:
+            return
+        for listener in self.listeners:
+            try:
+                listener(old_state, new_state)
+            except Exception as e:
+                logger.error(f"斷路器 {self.name} 狀態通知失敗: {str(e)}")
+
+    def before_call(self):
+        """請求前呼叫，不允許時立即拋出 CircuitOpenError"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN:
+                if time.monotonic() < self._opened_until:
+                    raise CircuitOpenError(f"{self.name} 暫時無法使用")
+                self._transition(HALF_OPEN)
+                self._half_open_calls = 0
+            if self._half_open_calls >= self.half_open_max_calls:
+                raise CircuitOpenError(f"{self.name} 正在恢復中")
+            self._half_open_calls += 1
+
+    def _evict(self, now):
+        while self._window and self._window[0][0] < now - self.window_seconds:
+            _, failed, slow = self._window.popleft()
+            self._failures -= failed
+            self._slow_calls -= slow
+
+    def _reset_window(self):
+        self._window.clear()
+        self._failures = 0
+        self._slow_calls = 0
+
+    def record(self, failed, latency):
+        """記錄一次請求的結果及耗時（秒）"""
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            old_state = self._state
+            if self._state == HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+                if failed or slow:
+                    self._opened_until = now + self.open_seconds
+                    self._transition(OPEN)
+                else:
+                    self._reset_window()
+                    self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._window.append((now, failed, slow))
+                self._failures += failed
+                self._slow_calls += slow
+                self._evict(now)
+                total = len(self._window)
+                if total >= self.min_calls and (
+                    self._failures / total >= self.error_rate_threshold
+                    or self._slow_calls / total >= self.slow_call_rate_threshold
+                ):
+                    logger.warning(
+                        f"斷路器 {self.name} 開啟: 最近 {total} 次請求中 "
+                        f"{self._failures} 次失敗、{self._slow_calls} 次超過 {self.slow_call_seconds} 秒"
+                    )
+                    self._opened_until = now + self.open_seconds
+                    self._reset_window()
+                    self._transition(OPEN)
+            new_state = self._state
+        self._notify(old_state, new_state)
+
+    def call(self, func, *args, **kwargs):
+        """經由斷路器執行 func，記錄結果及耗時"""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(self.is_failure(e), time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+        return result
@@ -0,0 +1,61 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class Deadline:
+    """以 time.monotonic() 表示的截止時間"""
+    __slots__ = ('expires_at',)
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def from_webhook_timestamp(cls, timestamp_ms, budget):
+        """依 webhook 事件的時間戳（毫秒）計算截止時間，扣除事件送達前已經過的時間"""
+        elapsed = 0.0
+        if timestamp_ms:
+            elapsed = max(0.0, time.time() - timestamp_ms / 1000.0)
+        return cls(time.monotonic() + budget - elapsed)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def extended(self, seconds):
+        return Deadline(self.expires_at + seconds)
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.3f}s)"
+
+
+MIN_TIMEOUT = 0.01
+
+# 目前處理中的事件的截止時間，對外請求以剩餘時間作為逾時
+_current_deadline = ContextVar('current_deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """在此範圍內的對外請求都以 deadline 的剩餘時間為上限"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def budget(cap):
+    """回傳對外請求應使用的逾時秒數：剩餘時間與 cap 取較小者；沒有截止時間時回傳 cap"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return cap
+    # 逾時不可為0（requests 會拒絕），時間用完時讓請求立即失敗
+    return max(MIN_TIMEOUT, min(cap, deadline.remaining()))
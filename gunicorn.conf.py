@@ -0,0 +1,11 @@
+# gunicorn 會自動讀取工作目錄中的此設定檔（gunicorn app:app）
+import gc
+
+# 在主程序載入 app（create_app）後再 fork 工作程序：憑證及 PRELOAD_TENANTS 指定的店家等不變的狀態只載入一次，
+# 各工作程序以 copy-on-write 共用；執行緒池、鎖及連線由 app.init_worker_state 在 fork 後重新建立
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # 把目前所有物件移出垃圾回收的追蹤範圍，避免工作程序執行GC時寫入共用的記憶體分頁而被複製
+    gc.freeze()
@@ -0,0 +1,148 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord 內建的屬性，其餘的屬性（logger.info(..., extra={...})）會輸出為JSON欄位
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌輸出一行JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """只把日誌放入佇列，訊息格式化及輸出都交給背景的 QueueListener
+
+    標準的 QueueHandler 會在呼叫端執行緒先格式化訊息，這裡只保留原始的 msg/args，
+    唯一在呼叫端處理的是例外的 traceback（exc_info 無法安全地跨執行緒延後處理）。
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """對大量的日誌只保留一部分，例如 {'app.health': 0.01} 表示健康檢查每100筆保留1筆
+
+    只取樣 WARNING 以下的日誌；以計數器決定保留哪幾筆，不需要亂數。
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {}
+        for name, rate in rates.items():
+            every = max(1, round(1 / rate)) if rate > 0 else 0
+            self.rates[name] = (every, itertools.count())
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name = record.name
+        while True:
+            sampling = self.rates.get(name)
+            if sampling is not None:
+                every, counter = sampling
+                return every > 0 and next(counter) % every == 0
+            if '.' not in name:
+                return True
+            name = name.rsplit('.', 1)[0]
+
+
+def parse_mapping(value):
+    """解析 'name=value,name2=value2' 格式的環境變量"""
+    mapping = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, _, setting = item.partition('=')
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def configure_logging(level=None, levels=None, sample_rates=None, fmt=None, stream=None):
+    """設定非同步的日誌輸出
+
+    - 呼叫端只把日誌放入佇列，由背景執行緒格式化並寫出
+    - LOG_FORMAT=json（默認）輸出結構化JSON，text 則使用原本的文字格式
+    - LOG_LEVEL 設定整體等級，LOG_LEVELS 可個別設定，例如 'werkzeug=WARNING,app.webhook=DEBUG'
+    - LOG_SAMPLE 設定取樣比例，例如 'app.health=0.01,app.webhook=0.1'
+
+    重複呼叫時會先停止之前的背景執行緒。
+    """
+    global _listener
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    levels = levels if levels is not None else parse_mapping(os.environ.get('LOG_LEVELS'))
+    if sample_rates is None:
+        sample_rates = {name: float(rate) for name, rate in parse_mapping(os.environ.get('LOG_SAMPLE')).items()}
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+
+    output_handler = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output_handler.setFormatter(JsonFormatter())
+    else:
+        output_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(queue_handler)
+        root.setLevel(level.upper())
+        for name, logger_level in levels.items():
+            logging.getLogger(name).setLevel(logger_level.upper())
+
+        _listener = QueueListener(log_queue, output_handler, respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """停止背景執行緒並寫出佇列中剩餘的日誌"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,109 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from linebot.exceptions import LineBotApiError
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """LINE 用戶顯示名稱的 LRU + TTL 快取
+
+    - 命中時不發出任何 API 請求
+    - 用戶封鎖或已不是好友（get_profile 回傳 404）時也快取結果（負向快取），
+      在 negative_ttl 內不再重複查詢
+    - prefetch() 在背景同時查詢多位用戶，並合併同一用戶重複的查詢
+    """
+
+    def __init__(self, fetch_profile, executor, max_size=1024, ttl=3600, negative_ttl=600):
+        self.fetch_profile = fetch_profile
+        self.executor = executor
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # {用戶ID: (到期時間, 顯示名稱或None)}
+        self._pending = {}  # {用戶ID: Future}，正在查詢中的用戶
+        self._lock = threading.Lock()
+
+    def reset_worker_state(self, executor):
+        """fork 後在子程序中改用新的執行緒池，並捨棄父程序中查詢到一半的 Future"""
+        self.executor = executor
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, user_id):
+        """回傳 (是否命中, 顯示名稱)，過期的項目直接移除"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return False, None
+            if entry[0] <= now:
+                del self._entries[user_id]
+                return False, None
+            self._entries.move_to_end(user_id)
+            return True, entry[1]
+
+    def _store(self, user_id, display_name, ttl):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, display_name)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, user_id):
+        display_name, ttl = None, None
+        try:
+            display_name, ttl = self.fetch_profile(user_id).display_name, self.ttl
+        except LineBotApiError as e:
+            if e.status_code == 404:
+                logger.info(f"用戶 {user_id} 已封鎖或不是好友，暫存為無資料")
+                ttl = self.negative_ttl
+            else:
+                logger.error(f"取得用戶 {user_id} 的個人資料失敗: {str(e)}")
+        except Exception as e:
+            logger.error(f"取得用戶 {user_id} 的個人資料失敗: {str(e)}")
+        # 其他錯誤（網路、限流等）不快取，下次重新查詢
+        if ttl is not None:
+            self._store(user_id, display_name, ttl)
+        with self._lock:
+            self._pending.pop(user_id, None)
+        return display_name
+
+    def _submit(self, user_id):
+        """提交背景查詢，同一用戶已在查詢中時回傳既有的 Future"""
+        with self._lock:
+            future = self._pending.get(user_id)
+            if future is None:
+                future = self.executor.submit(self._fetch, user_id)
+                self._pending[user_id] = future
+            return future
+
+    def peek(self, user_id):
+        """只查快取，不發出請求；未命中回傳None"""
+        return self._lookup(user_id)[1]
+
+    def get(self, user_id, timeout=None):
+        """取得顯示名稱，未命中時查詢 LINE API；查詢失敗或逾時回傳None"""
+        if not user_id:
+            return None
+        hit, display_name = self._lookup(user_id)
+        if hit:
+            return display_name
+        try:
+            return self._submit(user_id).result(timeout=timeout)
+        except Exception:
+            logger.warning(f"等待用戶 {user_id} 的個人資料逾時")
+            return None
+
+    def prefetch(self, user_ids):
+        """在背景同時查詢多位用戶，已快取或查詢中的用戶會被略過"""
+        for user_id in set(user_ids):
+            if user_id and not self._lookup(user_id)[0]:
+                self._submit(user_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
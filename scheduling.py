@@ -0,0 +1,153 @@
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+
+# 預約時間一律以台灣時間表示
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+
+class Service:
+    """服務項目的排程需求：所需時間（分鐘）及需要的資源種類（例如 chair、uv_lamp）"""
+    __slots__ = ('name', 'duration', 'resources')
+
+    def __init__(self, name, duration=30, resources=()):
+        self.name = name
+        self.duration = int(duration)
+        self.resources = tuple(resources)
+
+    def __repr__(self):
+        return f"Service({self.name!r}, duration={self.duration}, resources={self.resources})"
+
+
+class IntervalIndex:
+    """單一資源（一位美甲師、一張椅子或一台UV燈）當天已佔用的區間
+
+    區間依開始時間排序，並維護「到第 i 個區間為止的最晚結束時間」，
+    因此查詢 [start, end) 是否空閒只需一次二分搜尋：
+    開始時間早於 end 的區間中，只要最晚的結束時間晚於 start 就有衝突。
+    區間允許重疊（例如行事曆上重複的事件），新增及移除為 O(n)，查詢為 O(log n)。
+    """
+    __slots__ = ('_intervals', '_starts', '_max_ends')
+
+    def __init__(self):
+        self._intervals = []  # [(開始, 結束, 擁有者)]，依開始時間排序
+        self._starts = []
+        self._max_ends = []
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def _rebuild(self):
+        self._starts = [interval[0] for interval in self._intervals]
+        self._max_ends = []
+        latest = None
+        for _, end, _ in self._intervals:
+            latest = end if latest is None or end > latest else latest
+            self._max_ends.append(latest)
+
+    def add(self, start, end, owner=None):
+        insort(self._intervals, (start, end, owner), key=lambda interval: interval[0])
+        self._rebuild()
+
+    def remove(self, owner):
+        """移除 owner 佔用的所有區間，回傳移除的數量"""
+        before = len(self._intervals)
+        self._intervals = [interval for interval in self._intervals if interval[2] != owner]
+        self._rebuild()
+        return before - len(self._intervals)
+
+    def is_free(self, start, end):
+        count = bisect_left(self._starts, end)
+        return count == 0 or self._max_ends[count - 1] <= start
+
+
+class DaySchedule:
+    """某一天所有資源的排程
+
+    資源分為美甲師（每位一個 IntervalIndex）及共用資源池（例如3張椅子、2台UV燈，
+    每個單位一個 IntervalIndex，名稱為 'chair-1'、'uv_lamp-2'）。
+    時間一律以當天0點起算的分鐘數表示。
+    """
+
+    def __init__(self, stylist_ids, pools, open_minute, close_minute, step=30):
+        self.open_minute = open_minute
+        self.close_minute = close_minute
+        self.step = step
+        self.stylists = {stylist_id: IntervalIndex() for stylist_id in stylist_ids}
+        self.pools = {
+            pool: [(f"{pool}-{i + 1}", IntervalIndex()) for i in range(count)]
+            for pool, count in pools.items()
+        }
+        self._units = {name: index for units in self.pools.values() for name, index in units}
+
+    def block(self, stylist_id, start, end, resources=(), owner=None):
+        """標記美甲師及指定的資源單位在 [start, end) 已被佔用（不存在的資源會被略過）"""
+        if stylist_id in self.stylists:
+            self.stylists[stylist_id].add(start, end, owner)
+        for unit in resources:
+            index = self._units.get(unit)
+            if index is not None:
+                index.add(start, end, owner)
+
+    def release(self, owner):
+        """移除 owner 在所有資源上的佔用"""
+        for index in self.stylists.values():
+            index.remove(owner)
+        for index in self._units.values():
+            index.remove(owner)
+
+    def _free_unit(self, pool, start, end):
+        for name, index in self.pools.get(pool, ()):
+            if index.is_free(start, end):
+                return name
+        return None
+
+    def can_start(self, service, start, stylist_id=None):
+        """服務能否在 start 開始
+
+        Returns:
+            dict: 可以時回傳 {'stylist': 美甲師ID, 'resources': [資源單位, ...]}，否則回傳None
+        """
+        end = start + service.duration
+        if start < self.open_minute or end > self.close_minute:
+            return None
+
+        # 先確認共用資源，資源不足時不必逐一檢查美甲師
+        units = []
+        for pool in service.resources:
+            unit = self._free_unit(pool, start, end)
+            if unit is None:
+                return None
+            units.append(unit)
+
+        candidates = [stylist_id] if stylist_id is not None else list(self.stylists)
+        for candidate in candidates:
+            index = self.stylists.get(candidate)
+            if index is not None and index.is_free(start, end):
+                return {'stylist': candidate, 'resources': units}
+        return None
+
+    def feasible_starts(self, service):
+        """當天所有可開始的 (開始分鐘, 美甲師ID) 組合，依時間排序"""
+        options = []
+        for start in range(self.open_minute, self.close_minute - service.duration + 1, self.step):
+            end = start + service.duration
+            if any(self._free_unit(pool, start, end) is None for pool in service.resources):
+                continue
+            for stylist_id, index in self.stylists.items():
+                if index.is_free(start, end):
+                    options.append((start, stylist_id))
+        return options
+
+
+def format_minute(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def parse_minute(time_str):
+    hour, minute = time_str.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def today_str():
+    """台灣時間的今天（YYYY-MM-DD）"""
+    return datetime.now(TAIPEI_TZ).strftime('%Y-%m-%d')
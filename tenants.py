@@ -0,0 +1,240 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import OrderedDict, defaultdict, deque
+
+from waitlist import Waitlist
+from analytics import BookingStats
+
+logger = logging.getLogger(__name__)
+
+# 未設定 TENANTS_CONFIG 時，以原本的環境變量組成唯一的店家
+DEFAULT_TENANT = 'default'
+
+
+def tenant_env(tenant_id, name, default=None):
+    """讀取店家專屬的環境變量，例如店家 shop-a 的 LINE_CHANNEL_SECRET_SHOP_A"""
+    suffix = ''.join(c if c.isalnum() else '_' for c in tenant_id.upper())
+    return os.environ.get(f"{name}_{suffix}", default)
+
+
+class TenantRecords:
+    """店家的預約紀錄、候補名單、統計及延後的行事曆寫入，閒置的店家被釋放時仍然保留"""
+    __slots__ = ('bookings', 'manicurist_calendars', 'booking_lock', 'waitlist', 'stats', 'pending_calendar_writes')
+
+    def __init__(self):
+        # {用戶ID: 預約資訊}
+        self.bookings = {}
+        # {美甲師ID: {'YYYY-MM-DD HH:MM': {'user_id': 用戶ID, 'service': 服務, 'duration': 分鐘, 'resources': [資源單位, ...]}}}
+        self.manicurist_calendars = defaultdict(dict)
+        # 保護 bookings 及 manicurist_calendars；店家被釋放後重新建立時仍使用同一個鎖
+        self.booking_lock = threading.Lock()
+        self.waitlist = Waitlist()
+        self.stats = BookingStats()
+        # 行事曆斷路器開啟期間延後的寫入 (函數, 參數)，恢復後依序補寫
+        self.pending_calendar_writes = deque()
+
+    def reset_worker_state(self):
+        self.booking_lock = threading.Lock()
+        # 父程序延後的寫入不在每個工作程序中重複補寫
+        self.pending_calendar_writes = deque()
+        self.waitlist.reset_worker_state()
+        self.stats.reset_worker_state()
+
+
+class Tenant:
+    """一間店在這個程序中的狀態：LINE 客戶端、服務目錄、行事曆設定及各種快取
+
+    閒置一段時間後會被 TenantRegistry 釋放，下次收到該店的請求時重新建立；
+    預約紀錄保存在 records 中，不會隨之遺失。
+    """
+
+    def __init__(self, tenant_id, settings, channel_secret, line_bot_api, sign_postback,
+                 catalog_store, profile_cache, records, google_credentials=None,
+                 calendar_breaker_factory=None):
+        self.tenant_id = tenant_id
+        self.settings = settings
+        self.channel_secret = channel_secret
+        self.line_bot_api = line_bot_api
+        self.sign_postback = sign_postback
+        self.catalog_store = catalog_store
+        self.profile_cache = profile_cache
+        self.records = records
+
+        # 行事曆：店家自己的服務帳戶憑證（None 表示使用共用的憑證）及行事曆ID
+        self.google_credentials = google_credentials
+        self.calendar_id = settings.get('calendar_id')
+        self.manicurist_calendar_ids = dict(settings.get('manicurist_calendar_ids', {}))
+        # 每間店有自己的行事曆斷路器，一間店的行事曆或憑證異常不影響其他店
+        self.calendar_breaker_factory = calendar_breaker_factory
+        self._init_worker_state()
+
+    def _init_worker_state(self):
+        """每個工作程序各自擁有的狀態：行事曆連線、斷路器、快取及鎖"""
+        self.calendar_local = threading.local()
+        self.calendar_breaker = self.calendar_breaker_factory(self) if self.calendar_breaker_factory else None
+        # 可用時段快取 {日期: (到期時間, 查詢結果)}
+        self.availability_cache = {}
+        self.availability_cache_lock = threading.Lock()
+        # 最近一次成功查詢到的忙碌區間 {(美甲師ID, 日期): [(開始, 結束, 資源單位), ...]}
+        self.last_known_busy = OrderedDict()
+        self.last_known_busy_lock = threading.Lock()
+
+    def reset_worker_state(self):
+        """fork 後在子程序中重新建立連線、快取及鎖；服務目錄等不變的狀態繼續與父程序共用"""
+        self._init_worker_state()
+        self.catalog_store.reset_worker_state()
+
+    @property
+    def bookings(self):
+        return self.records.bookings
+
+    @property
+    def manicurist_calendars(self):
+        return self.records.manicurist_calendars
+
+    @property
+    def booking_lock(self):
+        return self.records.booking_lock
+
+    @property
+    def waitlist(self):
+        return self.records.waitlist
+
+    @property
+    def stats(self):
+        return self.records.stats
+
+    @property
+    def pending_calendar_writes(self):
+        return self.records.pending_calendar_writes
+
+    def __repr__(self):
+        return f"Tenant({self.tenant_id!r})"
+
+
+class TenantRegistry:
+    """依需要建立店家狀態，並釋放最久未使用或閒置過久的店家
+
+    configs 只是各店家的設定（很小），LINE 客戶端、服務目錄及快取等狀態
+    在第一次收到該店的請求時才由 factory(店家ID, 設定, 預約紀錄) 建立，
+    因此記憶體用量隨活躍的店家數增加，而不是隨設定的店家總數增加。
+    閒置的店家在建立新店家時，或在使用已建立的店家時（每 sweep_seconds 秒最多一次）釋放。
+    """
+
+    def __init__(self, configs, factory, max_active=32, idle_seconds=1800, sweep_seconds=60):
+        self.configs = configs
+        self.factory = factory
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        # 使用已建立的店家時，每 sweep_seconds 秒最多檢查一次閒置的店家
+        self.sweep_seconds = sweep_seconds
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._active = OrderedDict()  # {店家ID: [Tenant, 最後使用時間]}，前端是最久未使用的
+        self._records = {}
+        self._destinations = {
+            settings['destination']: tenant_id
+            for tenant_id, settings in configs.items() if settings.get('destination')
+        }
+
+    def tenant_ids(self):
+        return list(self.configs)
+
+    def active_count(self):
+        return len(self._active)
+
+    def active_tenants(self):
+        with self._lock:
+            return [entry[0] for entry in self._active.values()]
+
+    def resolve(self, destination):
+        """依 webhook 的 destination（機器人的用戶ID）找出店家ID
+
+        只設定一間店時不論 destination 都回傳該店，與單一店家的部署相容。
+        """
+        tenant_id = self._destinations.get(destination)
+        if tenant_id is None and len(self.configs) == 1:
+            tenant_id = next(iter(self.configs))
+        return tenant_id
+
+    def get(self, tenant_id):
+        """取得店家狀態，尚未建立時建立；未設定的店家回傳None"""
+        settings = self.configs.get(tenant_id)
+        if settings is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._active.get(tenant_id)
+            if entry is not None:
+                entry[1] = now
+                self._active.move_to_end(tenant_id)
+                if now >= self._next_sweep:
+                    self._evict(now)
+                return entry[0]
+            records = self._records.setdefault(tenant_id, TenantRecords())
+
+        # 在鎖外建立，避免一間店載入設定時阻塞其他店的請求
+        tenant = self.factory(tenant_id, settings, records)
+
+        with self._lock:
+            entry = self._active.get(tenant_id)
+            if entry is None:
+                # 其他執行緒沒有同時建立時才使用這次建立的狀態
+                entry = self._active[tenant_id] = [tenant, now]
+                logger.info(f"已載入店家 {tenant_id}（活躍店家數: {len(self._active)}）")
+            entry[1] = now
+            self._active.move_to_end(tenant_id)
+            self._evict(now)
+            return entry[0]
+
+    def reset_worker_state(self):
+        """fork 後在子程序中重新建立鎖及各店家的連線、快取，回傳已建立的店家"""
+        self._lock = threading.Lock()
+        for records in self._records.values():
+            records.reset_worker_state()
+        tenants = [entry[0] for entry in self._active.values()]
+        for tenant in tenants:
+            tenant.reset_worker_state()
+        return tenants
+
+    def evict(self, tenant_id):
+        """釋放店家狀態（例如設定變更後），下次使用時重新建立"""
+        with self._lock:
+            return self._active.pop(tenant_id, None) is not None
+
+    def _evict(self, now):
+        self._next_sweep = now + self.sweep_seconds
+        while len(self._active) > self.max_active:
+            tenant_id, _ = self._active.popitem(last=False)
+            logger.info(f"活躍店家數超過 {self.max_active}，釋放最久未使用的店家 {tenant_id}")
+        while self._active:
+            tenant_id, (_, last_used) = next(iter(self._active.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            self._active.popitem(last=False)
+            logger.info(f"釋放閒置的店家 {tenant_id}")
+
+
+_current_tenant = ContextVar('current_tenant', default=None)
+
+
+@contextmanager
+def tenant_scope(tenant):
+    """在區塊內把 tenant 設為目前處理中的店家"""
+    token = _current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
+
+
+def current_tenant():
+    """目前處理中的店家，不在任何店家的範圍內時拋出 RuntimeError"""
+    tenant = _current_tenant.get()
+    if tenant is None:
+        raise RuntimeError("目前沒有處理中的店家")
+    return tenant
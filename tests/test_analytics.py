@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from analytics import BookingStats
+
+TODAY = '2026-10-18'
+
+
+class BookingStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.today = TODAY
+        patcher = mock.patch('analytics.today_str', lambda: self.today)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 保留10天，其中未來3天：可記錄的日期為 10-12 ~ 10-21
+        self.stats = BookingStats(retention_days=10, future_days=3)
+
+    def report(self, start, end):
+        return self.stats.report(start, end, open_minute=600, close_minute=1200)
+
+    def test_counts_booking_and_cancellation(self):
+        self.stats.record_booking(TODAY, '10:30', '1', '凝膠', 90, lead_hours=30)
+        self.stats.record_cancellation(TODAY, '10:30', '1', 90)
+        self.stats.record_no_show(TODAY)
+        report = self.report(TODAY, TODAY)
+        self.assertEqual((report['bookings'], report['cancellations'], report['no_shows']), (1, 1, 1))
+        self.assertEqual(report['service_demand_by_hour']['凝膠'][10], 1)
+        self.assertEqual(report['lead_time_hours']['counts'][4], 1)
+        self.assertEqual(report['stylists']['1']['booked_minutes'], 0)
+
+    def test_minutes_spread_across_hours(self):
+        self.stats.record_booking(TODAY, '10:30', '1', '凝膠', 90)
+        hours = self.report(TODAY, TODAY)['stylists']['1']['minutes_by_hour']
+        self.assertEqual((hours[10], hours[11], hours[12]), (30, 60, 0))
+
+    def test_cancellation_minutes_clamp_at_zero(self):
+        self.stats.record_booking(TODAY, '10:00', '1', '卸甲', 30)
+        # 取消比預約更長的時段（或重複取消）不會讓分鐘數變成負數或溢位
+        self.stats.record_cancellation(TODAY, '10:00', '1', 60)
+        self.stats.record_cancellation(TODAY, '10:00', '1', 60)
+        hours = self.report(TODAY, TODAY)['stylists']['1']['minutes_by_hour']
+        self.assertEqual(hours[10], 0)
+        self.assertTrue(all(minutes == 0 for minutes in hours))
+
+    def test_dates_outside_window_are_ignored(self):
+        self.stats.record_booking('2026-10-11', '10:00', '1', '卸甲', 30)  # 早於保留範圍
+        self.stats.record_booking('2026-10-22', '10:00', '1', '卸甲', 30)  # 超過未來的天數
+        self.stats.record_no_show('2026-10-22')
+        self.stats.record_booking('2026-10-12', '10:00', '1', '卸甲', 30)
+        self.stats.record_booking('2026-10-21', '10:00', '1', '卸甲', 30)
+        self.assertEqual(self.report('2026-10-12', '2026-10-21')['bookings'], 2)
+        self.assertEqual(self.report('2026-10-22', '2026-10-22')['no_shows'], 0)
+
+    def test_far_future_date_does_not_wipe_recent_bucket(self):
+        # 2026-10-28 與 2026-10-18 落在同一個桶，但超出範圍而被略過
+        self.stats.record_booking(TODAY, '10:00', '1', '卸甲', 30)
+        self.stats.record_booking('2026-10-28', '10:00', '1', '卸甲', 30)
+        self.assertEqual(self.report(TODAY, TODAY)['bookings'], 1)
+
+    def test_bucket_reused_after_retention_days(self):
+        self.stats.record_booking(TODAY, '10:00', '1', '卸甲', 30)
+        self.stats.record_no_show(TODAY)
+        self.today = '2026-10-28'
+        self.stats.record_booking('2026-10-28', '11:00', '2', '凝膠', 60)
+        # 新的日期清空同一個桶，舊的日期不再出現在報表中
+        self.assertEqual(self.report(TODAY, TODAY)['bookings'], 0)
+        report = self.report('2026-10-28', '2026-10-28')
+        self.assertEqual((report['bookings'], report['no_shows']), (1, 0))
+        self.assertEqual(sum(report['stylists']['1']['minutes_by_hour']), 0)
+        self.assertEqual(report['stylists']['2']['minutes_by_hour'][11], 60)
+        # 桶已屬於較新的日期，舊日期的事件（例如延遲的取消）被略過
+        self.stats.record_cancellation(TODAY, '10:00', '1', 30)
+        self.assertEqual(self.report('2026-10-28', '2026-10-28')['cancellations'], 0)
+
+    def test_report_limited_to_retention_days(self):
+        report = self.report('2026-01-01', TODAY)
+        self.assertEqual(report['days'], 10)
+        self.assertEqual(report['start'], '2026-10-09')
+
+
+if __name__ == '__main__':
+    unittest.main()
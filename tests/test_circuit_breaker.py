@@ -0,0 +1,101 @@
+import unittest
+from unittest import mock
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('circuit_breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('calendar', window_seconds=60, min_calls=4,
+                                      error_rate_threshold=0.5, slow_call_seconds=3.0, open_seconds=30)
+        self.transitions = []
+        self.breaker.listeners.append(lambda old, new: self.transitions.append((old, new)))
+
+    def fail(self):
+        def boom():
+            raise RuntimeError('boom')
+        with self.assertRaises(RuntimeError):
+            self.breaker.call(boom)
+
+    def trip(self):
+        self.breaker.call(lambda: 'ok')
+        self.breaker.call(lambda: 'ok')
+        self.fail()
+        self.fail()
+
+    def test_stays_closed_below_min_calls(self):
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_open_half_open_close_cycle(self):
+        self.trip()
+        self.assertEqual(self.breaker.state, OPEN)
+        func = mock.Mock()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(func)
+        func.assert_not_called()
+
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.transitions, [(CLOSED, OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.clock.now += 30
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now += 29
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_half_open_allows_limited_probes(self):
+        self.trip()
+        self.clock.now += 30
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_slow_calls_open_the_circuit(self):
+        for _ in range(4):
+            self.breaker.record(False, 5.0)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_old_failures_leave_the_window(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 61
+        self.breaker.call(lambda: 'ok')
+        self.breaker.call(lambda: 'ok')
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_ignored_exceptions_are_not_failures(self):
+        self.breaker.is_failure = lambda exc: not isinstance(exc, KeyError)
+
+        def missing():
+            raise KeyError('x')
+        for _ in range(4):
+            with self.assertRaises(KeyError):
+                self.breaker.call(missing)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from scheduling import DaySchedule, IntervalIndex, Service
+
+
+class IntervalIndexTest(unittest.TestCase):
+    def test_empty_index_is_free(self):
+        self.assertTrue(IntervalIndex().is_free(600, 660))
+
+    def test_touching_intervals_do_not_conflict(self):
+        index = IntervalIndex()
+        index.add(600, 660)
+        self.assertTrue(index.is_free(540, 600))
+        self.assertTrue(index.is_free(660, 720))
+        self.assertFalse(index.is_free(630, 690))
+        self.assertFalse(index.is_free(570, 610))
+
+    def test_long_interval_hidden_behind_later_starts(self):
+        # 最晚結束時間要涵蓋較早開始的長區間，而不只是最後一個區間
+        index = IntervalIndex()
+        index.add(540, 900)
+        index.add(600, 630)
+        self.assertFalse(index.is_free(700, 730))
+        self.assertTrue(index.is_free(900, 930))
+
+    def test_remove_by_owner(self):
+        index = IntervalIndex()
+        index.add(600, 660, owner='a')
+        index.add(600, 660, owner='b')
+        self.assertEqual(index.remove('a'), 1)
+        self.assertFalse(index.is_free(600, 660))
+        index.remove('b')
+        self.assertTrue(index.is_free(600, 660))
+        self.assertEqual(len(index), 0)
+
+
+class DayScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.schedule = DaySchedule(['1', '2'], {'chair': 2, 'uv_lamp': 1}, open_minute=600, close_minute=1200)
+        self.gel = Service('凝膠', 90, ('chair', 'uv_lamp'))
+        self.removal = Service('卸甲', 30, ('chair',))
+
+    def test_assigns_stylist_and_resource_units(self):
+        self.assertEqual(
+            self.schedule.can_start(self.gel, 600, '1'),
+            {'stylist': '1', 'resources': ['chair-1', 'uv_lamp-1']}
+        )
+
+    def test_outside_business_hours(self):
+        self.assertIsNone(self.schedule.can_start(self.removal, 570))
+        self.assertIsNone(self.schedule.can_start(self.gel, 1140))
+        self.assertIsNotNone(self.schedule.can_start(self.removal, 1170))
+
+    def test_busy_stylist_falls_back_to_another(self):
+        self.schedule.block('1', 600, 660)
+        self.assertIsNone(self.schedule.can_start(self.removal, 630, '1'))
+        self.assertEqual(self.schedule.can_start(self.removal, 630)['stylist'], '2')
+
+    def test_shared_resource_exhausted(self):
+        # 唯一的UV燈被佔用時，即使美甲師及椅子都有空也不能開始
+        self.schedule.block('1', 600, 690, ['chair-1', 'uv_lamp-1'])
+        self.assertIsNone(self.schedule.can_start(self.gel, 630, '2'))
+        self.assertEqual(self.schedule.can_start(self.removal, 630, '2')['resources'], ['chair-2'])
+        self.assertIsNotNone(self.schedule.can_start(self.gel, 690, '2'))
+
+    def test_unknown_stylist(self):
+        self.assertIsNone(self.schedule.can_start(self.removal, 600, '9'))
+
+    def test_release(self):
+        self.schedule.block('1', 600, 690, ['chair-1', 'uv_lamp-1'], owner='booking')
+        self.schedule.release('booking')
+        self.assertIsNotNone(self.schedule.can_start(self.gel, 600, '1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from tenants import TenantRegistry
+
+
+class TenantRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('tenants.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.built = []
+
+    def registry(self, **kwargs):
+        configs = {tenant_id: {} for tenant_id in ('a', 'b', 'c')}
+
+        def factory(tenant_id, settings, records):
+            self.built.append(tenant_id)
+            return object()
+        return TenantRegistry(configs, factory, **kwargs)
+
+    def test_reuses_active_tenant(self):
+        registry = self.registry()
+        self.assertIs(registry.get('a'), registry.get('a'))
+        self.assertEqual(self.built, ['a'])
+        self.assertIsNone(registry.get('unknown'))
+
+    def test_evicts_least_recently_used(self):
+        registry = self.registry(max_active=2)
+        registry.get('a')
+        registry.get('b')
+        registry.get('a')
+        registry.get('c')
+        self.assertEqual(registry.active_count(), 2)
+        registry.get('b')
+        self.assertEqual(self.built, ['a', 'b', 'c', 'b'])
+
+    def test_idle_tenants_released_without_new_tenants(self):
+        # 只使用已建立的店家時，閒置的店家也要在下一次檢查時釋放
+        registry = self.registry(idle_seconds=100, sweep_seconds=10)
+        registry.get('a')
+        registry.get('b')
+        for _ in range(30):
+            self.now += 5
+            registry.get('a')
+        self.assertEqual(registry.active_count(), 1)
+        registry.get('b')
+        self.assertEqual(self.built, ['a', 'b', 'b'])
+
+    def test_records_survive_eviction(self):
+        records = []
+        registry = TenantRegistry({'a': {}}, lambda tenant_id, settings, record: records.append(record) or object())
+        registry.get('a')
+        registry.evict('a')
+        registry.get('a')
+        self.assertIs(records[0], records[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import hmac
+import json
+import base64
+import hashlib
+import unittest
+
+from linebot.exceptions import InvalidSignatureError
+
+from webhook import parse_events, verify_signature
+
+SECRET = b'channel-secret'
+
+
+def sign(body, secret=SECRET):
+    return base64.b64encode(hmac.new(secret, body, hashlib.sha256).digest()).decode('utf-8')
+
+
+def webhook_body(destination='U-shop', events=None):
+    if events is None:
+        events = [{
+            'type': 'message',
+            'timestamp': 1700000000000,
+            'replyToken': 'token',
+            'source': {'type': 'user', 'userId': 'U1'},
+            'message': {'type': 'text', 'text': '預約'},
+        }]
+    return json.dumps({'destination': destination, 'events': events}).encode('utf-8')
+
+
+class VerifySignatureTest(unittest.TestCase):
+    def test_valid_signature(self):
+        body = webhook_body()
+        self.assertTrue(verify_signature(body, sign(body), SECRET))
+
+    def test_tampered_body_or_wrong_secret(self):
+        body = webhook_body()
+        self.assertFalse(verify_signature(body + b' ', sign(body), SECRET))
+        self.assertFalse(verify_signature(body, sign(body, b'other-secret'), SECRET))
+
+
+class ParseEventsTest(unittest.TestCase):
+    def test_parses_events(self):
+        body = webhook_body()
+        events = parse_events(body, sign(body), SECRET)
+        self.assertEqual(len(events), 1)
+        event = events[0]
+        self.assertEqual(event.kind, 'message:text')
+        self.assertEqual((event.user_id, event.text, event.reply_token), ('U1', '預約', 'token'))
+        self.assertEqual(event.destination, 'U-shop')
+
+    def test_invalid_signature(self):
+        body = webhook_body()
+        with self.assertRaises(InvalidSignatureError):
+            parse_events(body, sign(body, b'other-secret'), SECRET)
+
+    def test_destination_selects_secret(self):
+        secrets = {'U-shop': SECRET, 'U-other': b'other-secret'}
+        body = webhook_body('U-other')
+        events = parse_events(body, sign(body, b'other-secret'), secrets.get)
+        self.assertEqual(events[0].destination, 'U-other')
+        with self.assertRaises(InvalidSignatureError):
+            parse_events(body, sign(body), secrets.get)
+
+    def test_unknown_destination(self):
+        body = webhook_body('U-unknown')
+        with self.assertRaises(InvalidSignatureError):
+            parse_events(body, sign(body), {'U-shop': SECRET}.get)
+
+    def test_non_json_body(self):
+        body = b'not json'
+        for secret in (SECRET, {None: SECRET}.get):
+            with self.assertRaises(InvalidSignatureError):
+                parse_events(body, sign(body), secret)
+
+    def test_non_object_body(self):
+        # 簽名正確但內容不是物件（例如陣列）時不可讓 payload.get 拋出 AttributeError
+        for body in (b'[]', b'"events"', b'{"events": {}}'):
+            for secret in (SECRET, lambda destination: SECRET):
+                with self.assertRaises(InvalidSignatureError):
+                    parse_events(body, sign(body), secret)
+
+    def test_skips_non_object_events(self):
+        body = webhook_body(events=[1, None, {'type': 'follow', 'source': {'userId': 'U2'}}])
+        events = parse_events(body, sign(body), SECRET)
+        self.assertEqual([(event.kind, event.user_id) for event in events], [('follow', 'U2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+from scheduling import today_str
+
+# 不指定美甲師的候補
+ANY_MANICURIST = '*'
+
+
+class Waiter:
+    """候補中的客戶"""
+    __slots__ = ('user_id', 'service', 'joined_at', 'seq')
+
+    def __init__(self, user_id, service, seq):
+        self.user_id = user_id
+        self.service = service
+        self.joined_at = time.time()
+        self.seq = seq
+
+    def __repr__(self):
+        return f"Waiter({self.user_id!r}, {self.service!r})"
+
+
+class Hold:
+    """釋出後暫時保留給被通知的候補客戶的時段（分鐘），到期前不提供給其他客戶"""
+    __slots__ = ('manicurist_id', 'start', 'end', 'user_ids', 'expires_at')
+
+    def __init__(self, manicurist_id, start, end, user_ids, expires_at):
+        self.manicurist_id = manicurist_id
+        self.start = start
+        self.end = end
+        self.user_ids = frozenset(user_ids)
+        self.expires_at = expires_at
+
+
+class Waitlist:
+    """以 (日期, 時段區間, 美甲師) 為索引的候補名單
+
+    每個索引鍵是一個依加入順序排列的佇列，釋出時段時只需查詢與該時段相關的幾個鍵，
+    不需掃描所有候補。美甲師可為 ANY_MANICURIST（任何美甲師皆可）。
+    已過去的日期在每天第一次加入候補或保留時段時一併清除。
+    """
+
+    def __init__(self, max_per_key=100):
+        self.max_per_key = max_per_key
+        self._lock = threading.Lock()
+        self._queues = {}  # {日期: {(時段區間, 美甲師ID): deque[Waiter]}}
+        self._holds = {}  # {日期: [Hold, ...]}
+        self._seq = itertools.count()
+        self._purged_on = None  # 最近一次清除過去日期的日期
+
+    def reset_worker_state(self):
+        """fork 後在子程序中重新建立鎖"""
+        self._lock = threading.Lock()
+
+    def join(self, date_str, window, manicurist_id, user_id, service):
+        """加入候補，已在同一佇列中時更新服務項目
+
+        Returns:
+            int: 在佇列中的位置（從1開始），佇列已滿時回傳None
+        """
+        with self._lock:
+            self._purge_past()
+            queue = self._queues.setdefault(date_str, {}).setdefault((window, manicurist_id), deque())
+            for position, waiter in enumerate(queue, 1):
+                if waiter.user_id == user_id:
+                    waiter.service = service
+                    return position
+            if len(queue) >= self.max_per_key:
+                return None
+            queue.append(Waiter(user_id, service, next(self._seq)))
+            return len(queue)
+
+    def take(self, date_str, windows, manicurist_id, count, accept=None):
+        """依加入順序取出最多 count 位符合條件的候補客戶（同時查詢指定美甲師及不指定美甲師的佇列）
+
+        accept(waiter) 回傳False的客戶留在佇列中；同一客戶只會被取出一次。
+        """
+        with self._lock:
+            by_key = self._queues.get(date_str)
+            if not by_key:
+                return []
+            queues = [
+                by_key[key]
+                for window in windows
+                for key in ((window, manicurist_id), (window, ANY_MANICURIST))
+                if key in by_key
+            ]
+            taken = []
+            taken_users = set()
+            for waiter in heapq.merge(*[list(queue) for queue in queues], key=lambda w: w.seq):
+                if len(taken) >= count:
+                    break
+                if waiter.user_id in taken_users or (accept is not None and not accept(waiter)):
+                    continue
+                taken.append(waiter)
+                taken_users.add(waiter.user_id)
+            if taken_users:
+                self._remove_users(date_str, taken_users)
+            return taken
+
+    def _purge_past(self):
+        """移除今天以前的候補及保留時段，每天只掃描一次（需持有 _lock）"""
+        today = today_str()
+        if self._purged_on == today:
+            return
+        self._purged_on = today
+        for by_date in (self._queues, self._holds):
+            for date_str in [date_str for date_str in by_date if date_str < today]:
+                del by_date[date_str]
+
+    def _remove_users(self, date_str, user_ids):
+        by_key = self._queues.get(date_str, {})
+        for key in list(by_key):
+            queue = deque(waiter for waiter in by_key[key] if waiter.user_id not in user_ids)
+            if queue:
+                by_key[key] = queue
+            else:
+                del by_key[key]
+        if not by_key:
+            self._queues.pop(date_str, None)
+
+    def hold(self, date_str, manicurist_id, start, end, user_ids, seconds):
+        """為被通知的客戶保留 [start, end) 時段 seconds 秒"""
+        with self._lock:
+            self._purge_past()
+            self._holds.setdefault(date_str, []).append(
+                Hold(manicurist_id, start, end, user_ids, time.monotonic() + seconds)
+            )
+
+    def held_intervals(self, date_str, user_id=None):
+        """回傳當天仍在保留中、且不是保留給 user_id 的 (美甲師ID, 開始, 結束) 列表"""
+        with self._lock:
+            holds = self._holds.get(date_str)
+            if not holds:
+                return []
+            now = time.monotonic()
+            active = [hold for hold in holds if hold.expires_at > now]
+            if active:
+                self._holds[date_str] = active
+            else:
+                del self._holds[date_str]
+            return [
+                (hold.manicurist_id, hold.start, hold.end)
+                for hold in active if user_id not in hold.user_ids
+            ]
+
+    def booked(self, date_str, user_id):
+        """客戶在當天完成預約後，移除其候補，並把該客戶從保留時段的名單中移除
+
+        預約的時段本身已被佔用；保留給其他客戶的部分維持到期前不對外提供。
+        """
+        with self._lock:
+            self._remove_users(date_str, {user_id})
+            holds = self._holds.get(date_str)
+            if holds:
+                remaining = []
+                for hold in holds:
+                    if user_id in hold.user_ids:
+                        hold.user_ids = hold.user_ids - {user_id}
+                    if hold.user_ids:
+                        remaining.append(hold)
+                if remaining:
+                    self._holds[date_str] = remaining
+                else:
+                    del self._holds[date_str]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(queue) for by_key in self._queues.values() for queue in by_key.values())
@@ -0,0 +1,101 @@
+import hmac
+import base64
+import hashlib
+
+from linebot.exceptions import InvalidSignatureError
+
+# 有安裝 orjson 時使用較快的解析器，否則退回標準庫
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    _loads = json.loads
+
+
+class WebhookEvent:
+    """只保留處理函數會用到的欄位的輕量事件
+
+    取代 SDK 為每個事件建立的完整模型物件（Source、Message、Postback...）。
+    """
+    __slots__ = (
+        'type', 'message_type', 'timestamp', 'reply_token', 'user_id',
+        'text', 'data', 'params', 'destination', 'deadline', 'tenant'
+    )
+
+    def __init__(self, raw, destination):
+        message = raw.get('message') or {}
+        postback = raw.get('postback') or {}
+        self.type = raw.get('type')
+        self.message_type = message.get('type')
+        self.timestamp = raw.get('timestamp')
+        self.reply_token = raw.get('replyToken')
+        self.user_id = (raw.get('source') or {}).get('userId')
+        self.text = message.get('text')
+        self.data = postback.get('data')
+        self.params = postback.get('params')
+        self.destination = destination
+        # 回覆期限（deadline.Deadline），由分派前依 timestamp 設定
+        self.deadline = None
+        # 事件所屬的店家（tenants.Tenant），由分派前設定
+        self.tenant = None
+
+    @property
+    def kind(self):
+        """事件分派用的鍵，例如 'message:text'、'postback'、'follow'"""
+        if self.type == 'message':
+            return f"message:{self.message_type}"
+        return self.type
+
+    def __repr__(self):
+        return f"WebhookEvent(kind={self.kind!r}, user_id={self.user_id!r})"
+
+
+def verify_signature(body, signature, channel_secret):
+    """以原始位元組驗證 X-Line-Signature（HMAC-SHA256 後以 Base64 編碼）"""
+    digest = hmac.new(channel_secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode('utf-8'))
+
+
+def parse_events(body, signature, channel_secret):
+    """驗證簽名並解析 webhook 內容
+
+    Args:
+        body: 請求的原始位元組（不需先解碼成文字）
+        signature: X-Line-Signature header 值
+        channel_secret: Channel Secret 的位元組，或依 destination 回傳 Channel Secret 位元組的函數
+            （多店家時使用，回傳None表示沒有對應的店家）
+
+    Returns:
+        list: WebhookEvent 列表
+
+    Raises:
+        InvalidSignatureError: 簽名不符、沒有對應的店家或內容不是 webhook 物件時
+    """
+    if callable(channel_secret):
+        # 需要先讀出 destination 才知道用哪個 Secret 驗證，驗證通過前不使用其他內容
+        try:
+            payload = _loads(body)
+        except ValueError:
+            raise InvalidSignatureError("Invalid request body")
+        destination = payload.get('destination') if isinstance(payload, dict) else None
+        secret = channel_secret(destination)
+        if secret is None:
+            raise InvalidSignatureError(f"Unknown destination. destination={destination}")
+        if not verify_signature(body, signature, secret):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+    else:
+        if not verify_signature(body, signature, channel_secret):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+        try:
+            payload = _loads(body)
+        except ValueError:
+            raise InvalidSignatureError("Invalid request body")
+        destination = payload.get('destination') if isinstance(payload, dict) else None
+    # 簽名正確但內容不是 {"events": [...]} 物件時同樣視為無效的請求
+    events = payload.get('events', []) if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        raise InvalidSignatureError("Invalid request body")
+    return [WebhookEvent(raw, destination) for raw in events if isinstance(raw, dict)]